@@ -13,7 +13,7 @@ import importlib
 
 from . import __version__
 from .constants import *
-from .xspawner import Config, State
+from .xspawner import Config, State, prefork
 from .utilities.misc import get_similar_cls
 
 if __name__ == '__main__':
@@ -32,6 +32,13 @@ if __name__ == '__main__':
         parser.add_argument("--ssl", action="store_true", help="SSL/TLS Support")
         parser.add_argument("--certfile", type=str, help="Certification file")
         parser.add_argument("--keyfile", type=str, help="Private key file")
+        parser.add_argument("--concurrency", type=int, default=REQ_CONCURRENCY, help="Concurrent request consumers")
+        parser.add_argument("--queue", type=int, default=REQ_QUEUE_SIZE, help="Queued requests per lane")
+        parser.add_argument("--workers", type=int, default=HTTP_WORKERS, help="Pre-forked processes sharing the port, the routes managing children, their flows and reports are served by the first one and forwarded there by the others")
+        parser.add_argument("--threads", type=int, default=SYNC_THREADS, help="Threads for blocking routes")
+        parser.add_argument("--services", type=str, default=SERVICE_BACKEND, choices=["systemctl", "fake"], help="Service control backend")
+        parser.add_argument("--logqueue", type=int, default=LOG_QUEUE_SIZE, help="Queued log records, 0 writes in the caller")
+        parser.add_argument("--recorder", type=str, default="", help="Log server url receiving batches, the log file if empty")
         args = parser.parse_args()
         
         globals()["__version__"] = __version__
@@ -39,7 +46,9 @@ if __name__ == '__main__':
         srv_cls = get_similar_cls("{}.{}".format(PLUGIN_PKG, args.plugin), 'Spawner', 1)
         if srv_cls:
             cmd_args = vars(args)
-            srv_cls.getServer(config=Config(**cmd_args),state=State(),children=[]).start()
+            config = Config(**cmd_args)
+            shared = prefork(config)
+            srv_cls.getServer(config=config,state=State(),children=[],**shared).start()
         else:
             print("Err: the plugin {} is not found!".format(args.plugin))
     except Exception as e:
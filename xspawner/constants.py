@@ -10,3 +10,44 @@ LOG_DIR = f"/var/log/{SYSTEM_ID}"
 LOG_FILE = LOG_DIR + f"/{SYSTEM_ID}.log"
 PYTHON_MIME_TYPE = "text/x-python"
 ZIP_MIME_TYPE = "application/zip"
+JSON_MIME_TYPE = "application/json"
+MSGPACK_MIME_TYPE = "application/msgpack"
+NDJSON_MIME_TYPE = "application/x-ndjson"
+REQ_QUEUE_SIZE = 256
+REQ_CONCURRENCY = 8
+REQ_TIMEOUT = 5.0
+REQ_RETRY_AFTER = 1
+REQ_LANES = ("control", "normal", "bulk")
+HTTP_WORKERS = 1
+# request headers relayed by a pre-forked worker to the primary one
+FORWARD_HEADERS = ("content-type", "accept", "last-event-id")
+SYNC_THREADS = 4
+SERVICE_BACKEND = "systemctl"
+SERVICE_STATUS_TTL = 5.0
+SERVICE_REFRESH_INTERVAL = 2.0
+LOG_QUEUE_SIZE = 10000
+LOG_BATCH_FORMAT = "ndjson"
+LOG_BATCH_SIZE = 100
+LOG_BUFFER_SIZE = 10000
+LOG_FLUSH_INTERVAL = 1.0
+LOG_RETRY_BASE = 0.5
+LOG_RETRY_MAX = 30.0
+UPLOAD_MAX_SIZE = 1024 * 1024 * 1024
+CHUNK_SIZE = 64 * 1024
+POOL_MAX_PER_HOST = 8
+POOL_MAX_CLIENTS = 64
+POOL_TIMEOUT = 20.0
+FLOW_BACKLOG = 16
+FLOW_REPLAY = 64
+FLOW_RETRY_BASE = 0.5
+FLOW_RETRY_MAX = 30.0
+REPORT_SNAPSHOT = 30
+REPORT_TTL = 120.0
+REPORT_MAX = 1024
+START_CONCURRENCY = 8
+STOP_CONCURRENCY = 8
+PROBE_DELAY = 0.05
+PROBE_DELAY_MAX = 1.0
+PROBE_TIMEOUT = 10.0
+START_TIMEOUT = 20.0
+SPAWN_BUCKETS = (0.1, 0.25, 0.5, 1.0, 2.0, 5.0, 10.0, 20.0)
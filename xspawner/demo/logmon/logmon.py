@@ -3,6 +3,7 @@
 from xspawner.constants import * # NOQA
 from xspawner.plugins.spawner import * # NOQA
 from xspawner.xspawner import * # NOQA
+from xspawner.utilities import codec
 import tornado.queues
 import os.path
 import datetime
@@ -35,15 +36,17 @@ class Logmon(Spawner):
         end_point = '{}/flow'.format(self.getAddr())
         return page.replace('ENDPOINT', end_point)
 
-    # pop up logs from q
-    @FlowHandler.route("/flow")
-    def _flow(self, headers: dict, data: dict):
-        logs = [self.q.get_nowait() for _ in range(self.q.qsize())]
-        evt = {
-            "event": "message",
-            "data": json.dumps(logs, separators=(',', ':'), ensure_ascii=False)
-        }
-        return evt
+    # pop up logs from q as soon as they arrive
+    @FlowHandler.route("/flow", broadcast=True)
+    async def _flow(self, headers: dict, data: dict):
+        while True:
+            logs = [await self.q.get()]
+            logs.extend(self.q.get_nowait() for _ in range(self.q.qsize()))
+            evt = {
+                "event": "message",
+                "data": codec.dumps(logs)
+            }
+            yield evt
 
     # push a log to q like the following request
     # ENDPOINT/queue?timestamp=2026-06-10T13:20:00&severity=info&system=unknown&content=Hello
@@ -51,16 +54,19 @@ class Logmon(Spawner):
     # system: log source, string type of client/service name
     # timestamp: log time, string type of ISO 8601
     # content: log detail, string type
+    # a batch of logs is posted as a JSON array or as NDJSON, one log per line
     @ApiHandler.route("/queue")
-    def _queue(self, headers: dict, data: dict):
-        self.iLog(f"receive {data}")
-        if self.q.full():
+    def _queue(self, headers: dict, data: Any):
+        logs = data if isinstance(data, list) else [data]
+        self.dLog("receive %s logs", len(logs))
+        for log in logs:
+            if self.q.full():
+                try:
+                    self.q.get_nowait()
+                except tornado.queues.QueueEmpty:
+                    self.wLog("queue is empty")
             try:
-                self.q.get_nowait()
-            except tornado.queues.QueueEmpty:
-                self.wLog("queue is empty")
-        try:
-            self.q.put_nowait(data)
-        except tornado.queues.QueueFull:
-            self.wLog("queue is full and cannot append")
+                self.q.put_nowait(log)
+            except tornado.queues.QueueFull:
+                self.wLog("queue is full and cannot append")
         return True
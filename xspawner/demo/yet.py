@@ -14,7 +14,7 @@ class Yet(Spawner):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    @ApiHandler.route("/upload")
+    @ApiHandler.route("/upload", offload=True)
     def _upload(self, headers: dict, fdata: bytes, fname: str, fargs: dict):
         with open(fname, "wb") as f:
             f.write(fdata)
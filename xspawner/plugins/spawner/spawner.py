@@ -6,13 +6,17 @@ from xspawner.utilities.msg import * # NOQA
 from xspawner.constants import * # NOQA
 from xspawner.service import * # NOQA
 from xspawner.xspawner import * # NOQA
+from xspawner.utilities import codec
 import tornado.gen
 import tornado.queues
 import tornado.httpclient
+import tornado.locks
 import requests
 from requests.exceptions import RequestException
 import psutil
 
+import asyncio
+import contextlib
 import inspect
 import importlib
 import unittest
@@ -32,159 +36,378 @@ import signal
 import mimetypes
 import datetime
 import random
+import functools
+import weakref
 
 
 ##############################################################################
 # Constants and Variables and Classes
 ##############################################################################
 
-class Spawner(XSpawner): # NOQA
-    _reports = dict()
+# ReportStore keeps the latest state reported for every name of the subtree
+#   every change or removal takes a new revision, a removal is kept as None for ttl
+#   a name not seen for ttl expires, the least recently seen one is evicted beyond max_entries
+#   source is the child the name is reported through, removing a child removes its subtree
+class ReportStore:
+    def __init__(self, ttl=REPORT_TTL, max_entries=REPORT_MAX):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.reports = dict()
+        self.revisions = dict()
+        self.seen = dict()
+        self.sources = dict()
+        self.revision = 0
+        self.stats = {"expired": 0, "evicted": 0, "removed": 0}
+
+    def set(self, name, state, source=None):
+        if state is None:
+            self.drop(name, "removed")
+            return
+        self.seen[name] = time.monotonic()
+        self.sources[name] = source
+        if self.reports.get(name) == state:
+            return
+        if name not in self.reports and len(self.reports) >= self.max_entries:
+            self.drop(min(self.reports, key=self.seen.get), "evicted")
+        self.reports[name] = state
+        self.bump(name)
+
+    # a snapshot of source is its whole subtree, names of source missing from it are removed
+    def replace(self, report, source):
+        for name in [name for name, owner in self.sources.items() if owner == source and name not in report]:
+            self.drop(name, "removed")
+        for name, state in report.items():
+            self.set(name, state, source)
+
+    def remove(self, name):
+        for sub in [sub for sub, source in self.sources.items() if source == name]:
+            self.drop(sub, "removed")
+        self.drop(name, "removed")
+
+    def drop(self, name, reason):
+        if name not in self.reports:
+            return
+        del self.reports[name]
+        self.sources.pop(name, None)
+        self.seen[name] = time.monotonic()
+        self.stats[reason] += 1
+        self.bump(name)
+
+    def bump(self, name):
+        self.revision += 1
+        self.revisions[name] = self.revision
+
+    def expire(self):
+        deadline = time.monotonic() - self.ttl
+        for name in [name for name, seen in self.seen.items() if seen < deadline]:
+            if name in self.reports:
+                self.drop(name, "expired")
+            else:
+                del self.seen[name]
+                del self.revisions[name]
 
-    def getReports(self):
-        return self._reports
+    # reports changed after revision, removed ones are None
+    def delta(self, revision):
+        return {name: self.reports.get(name) for name, rev in self.revisions.items() if rev > revision}
 
-    def setReport(self, report):
-        return self._reports.update(report)
+    def getStats(self):
+        return dict(
+            self.stats,
+            entries=len(self.reports),
+            tombstones=len(self.revisions) - len(self.reports),
+            bytes=sum(len(codec.dumps(state)) for state in self.reports.values()),
+            ttl=self.ttl,
+            max_entries=self.max_entries
+        )
 
-    @ApiHandler.route("/get_config")
+
+class Spawner(XSpawner): # NOQA
+    _reports = ReportStore()
+    # _report_sent is the report revision already sent up
+    _report_sent = 0
+    _report_ticks = 0
+    # _subscriptions are the urls of the flows kept connected by addFlow
+    _subscriptions = set()
+    # _child_locks keep the start and the stop of one child from overlapping, like {<name>: <Lock>}
+    #   a lock is dropped once nobody holds or waits for it, so names of gone children do not pile up
+    _child_locks = weakref.WeakValueDictionary()
+    # _spawn_times are the seconds for systemd to start a child and for the child to answer /ping
+    _spawn_times = {
+        "service": Histogram(SPAWN_BUCKETS),
+        "ready": Histogram(SPAWN_BUCKETS),
+        "total": Histogram(SPAWN_BUCKETS)
+    }
+
+    def getReports(self):
+        return self._reports.reports
+
+    # report is like {<name>: <state>}, a None state removes the name
+    #   source is the child reporting it, a snapshot report replaces everything source reported before
+    def setReport(self, report, source=None, snapshot=False):
+        self._reports.expire()
+        if snapshot:
+            self._reports.replace(report, source)
+            return
+        for name, state in report.items():
+            self._reports.set(name, state, source)
+
+    # reports changed after revision, removed ones are None
+    def getReportDelta(self, revision):
+        return self._reports.delta(revision)
+
+    def getInfo(self):
+        info = super().getInfo()
+        info["reports"] = self._reports.getStats()
+        return info
+
+    def getMetrics(self):
+        metrics = super().getMetrics()
+        metrics["spawn"] = {phase: hist.__json__() for phase, hist in self._spawn_times.items()}
+        metrics["services"] = dict(self._services.stats)
+        return metrics
+
+    @ApiHandler.route("/get_config", reentrant=True)
     def _get_config(self, headers: dict, data: dict):
         return self.getConfig()._asdict()
 
 
-    @ApiHandler.route("/get_state")
+    @ApiHandler.route("/get_state", reentrant=True, lane="control")
     def _get_state(self, headers: dict, data: dict):
         return dict(self.getState())
 
-    @ApiHandler.route("/set_state")
+    @ApiHandler.route("/set_state", lane="control")
     def _set_state(self, headers: dict, data: dict):
         self.setState(data)
         return True
 
-    @ApiHandler.route("/get_children")
+    @ApiHandler.route("/get_children", reentrant=True)
     def _get_children(self, headers: dict, data: dict):
         return self.getChildren()
 
-    @ApiHandler.route("/add_child")
+    @ApiHandler.route("/add_child", lane="control", primary=True)
     async def _add_child(self, headers: dict, data: dict):
-        self.iLog("{}::_add_child BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_add_child BEG %s", self.__class__.__name__, data)
         if "name" not in data \
         or "addr" not in data:
-            self.eLog(f"Failed to add child, miss name or addr in data {data}")
+            self.eLog("Failed to add child, miss name or addr in data %s", data)
             return False
         srvaddr = data["addr"]
-        self.iLog(f"{srvaddr} is connectable")
+        self.iLog("%s is connectable", srvaddr)
         self.addChild({"name": data["name"], "addr": data["addr"]})
         # add reportup flow
         if self.getConfig().reportup:
-            self.addFlow(f"{srvaddr}/report/state?interval=1", self.on_state)
-        self.iLog("{}::_add_child END".format(self.__class__.__name__))
+            self.addFlow(f"{srvaddr}/report/state?interval=1", functools.partial(self.on_state, source=data["name"]))
+        self.iLog("%s::_add_child END", self.__class__.__name__)
         return True
 
-    @ApiHandler.route("/start_child")
+    @ApiHandler.route("/start_child", serial=True, timeout=30, lane="control", primary=True)
     async def _start_child(self, headers: dict, data: dict):
-        self.iLog("{}::_start_child BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_start_child BEG %s", self.__class__.__name__, data)
         if "port" not in data \
         or "name" not in data \
         or "plugin" not in data:
-            self.eLog(f"Failed to start child, miss port or name or plugin in data {data}")
+            self.eLog("Failed to start child, miss port or name or plugin in data %s", data)
             return False
 
-        srvancestry = "{}:{}".format(self.getConfig().name, self.getConfig().port)
-        child_config = self.getConfig()._replace(port=data["port"], name=data["name"], plugin=data["plugin"], ancestry=srvancestry)
-        rt = open_service(child_config)
-        self.iLog(f"open_service: {rt}")
-        if "success" in rt and not rt["success"]:
-            self.eLog(f"failed to start child {child_config.name}!")
+        child_config = self.getChildConfig(data)
+        async with self.getChildLock(child_config.name):
+            begin = self._ioloop.time()
+            rt = await self._services.openService(child_config)
+            self.iLog("open_service: %s", rt)
+            if "success" in rt and not rt["success"]:
+                self.eLog("failed to start child %s!", child_config.name)
+                return False
+            started = self._ioloop.time()
+
+            new_srv = await self.readyChild(child_config, begin, started)
+        self.iLog("%s::_start_child END %s", self.__class__.__name__, new_srv)
+        return new_srv
+
+    # start many children like {"children": [<data of /start_child>, ...]}
+    #   all unit files are written before a single daemon-reload, then the units are started in parallel
+    #   results are in the order of children, a child is False if it failed
+    #   if the route times out, the units of this call are closed instead of being left running unreported
+    @ApiHandler.route("/start_children", serial=True, timeout=60, lane="control", primary=True)
+    async def _start_children(self, headers: dict, data: dict):
+        self.iLog("%s::_start_children BEG %s", self.__class__.__name__, data)
+        children = data.get("children")
+        if not isinstance(children, list):
+            self.eLog("Failed to start children, miss children list in data %s", data)
             return False
 
-        await tornado.gen.sleep(1)
+        results = [False] * len(children)
+        valid = []
+        for i, child in enumerate(children):
+            if isinstance(child, dict) and "port" in child and "name" in child and "plugin" in child:
+                valid.append(i)
+            else:
+                self.eLog("Failed to start child, miss port or name or plugin in data %s", child)
+        child_configs = [self.getChildConfig(children[i]) for i in valid]
+        if not child_configs:
+            return results
+
+        begin = self._ioloop.time()
+        try:
+            new_srvs = await self.startChildren(child_configs, begin)
+        except asyncio.CancelledError:
+            self.wLog("%s::_start_children is cancelled, closing %s", self.__class__.__name__, [c.name for c in child_configs])
+            for child_config in child_configs:
+                asyncio.ensure_future(self.dropChild(child_config.name))
+            raise
+        for i, new_srv in zip(valid, new_srvs):
+            results[i] = new_srv
+        self.iLog("%s::_start_children END %s", self.__class__.__name__, results)
+        return results
+
+    async def startChildren(self, child_configs, begin):
+        async with contextlib.AsyncExitStack() as stack:
+            for name in sorted(set(child_config.name for child_config in child_configs)):
+                await stack.enter_async_context(self.getChildLock(name))
+            return await self.prepareChildren(child_configs, begin)
+
+    async def prepareChildren(self, child_configs, begin):
+        rts = await self._services.prepareServices(child_configs)
+        sem = tornado.locks.Semaphore(START_CONCURRENCY)
+        async def start_child(child_config, rt):
+            self.iLog("prepare_services: %s", rt)
+            if not rt["success"]:
+                self.eLog("failed to prepare child %s!", child_config.name)
+                return False
+            async with sem:
+                if not await self._services.start(child_config.name):
+                    self.eLog("failed to start child %s!", child_config.name)
+                    return False
+            started = self._ioloop.time()
+            return await self.readyChild(child_config, begin, started)
+        return await tornado.gen.multi([start_child(*args) for args in zip(child_configs, rts)])
+
+    # remove the unit of a child just started and forget the child if it has registered
+    async def dropChild(self, child_name):
+        async with self.getChildLock(child_name):
+            rt = await self._services.closeService(child_name)
+            self.iLog("delete service: %s", rt)
+            elm = self.getChild(child_name)
+            if elm:
+                self.delChild(child_name)
+                if "addr" in elm:
+                    self.delFlow(f"{elm['addr']}/report/state?interval=1")
+            self._reports.remove(child_name)
+
+    def getChildLock(self, name):
+        lock = self._child_locks.get(name)
+        if lock is None:
+            lock = self._child_locks[name] = tornado.locks.Lock()
+        return lock
+
+    def getChildConfig(self, data):
+        srvancestry = "{}:{}".format(self.getConfig().name, self.getConfig().port)
+        return self.getConfig()._replace(port=data["port"], name=data["name"], plugin=data["plugin"], ancestry=srvancestry)
 
-        sts = get_service_status(data["name"])
+    # wait for a started child to answer on its port and describe it, False if it does not in time
+    async def readyChild(self, child_config, begin, started):
+        srvaddr = "{}:{}".format(
+            self.getHostAddr(),
+            child_config.port)
+        if not await self.waitServer(srvaddr, timeout=START_TIMEOUT):
+            self.eLog("child %s is not ready in %ss!", child_config.name, START_TIMEOUT)
+            return False
+        ready = self._ioloop.time()
+        self._spawn_times["service"].observe(started - begin)
+        self._spawn_times["ready"].observe(ready - started)
+        self._spawn_times["total"].observe(ready - begin)
+        self.iLog("child %s is ready in %.3fs", child_config.name, ready - begin)
+
+        sts = await self._services.getStatus(child_config.name)
         pid = sts["pid"]
-        self.iLog(f"service status: {sts}")
+        self.iLog("service status: %s", sts)
 
-        pkgdir = "{}/{}".format(PLUGIN_DIR, data["plugin"])
+        pkgdir = "{}/{}".format(PLUGIN_DIR, child_config.plugin)
         if os.path.exists(pkgdir):
-            pkgfname = "{}/{}.py".format(pkgdir, data["plugin"])
+            pkgfname = "{}/{}.py".format(pkgdir, child_config.plugin)
         else:
             pkgfname = "{}.py".format(pkgdir)
         srvcls = search_for_class_in_file(pkgfname, "Spawner")
 
-        srvaddr = "{}:{}".format(
-            self.getHostAddr(),
-            data["port"])
-        new_srv = {"name": data["name"], "plugin": data["plugin"], "cls": srvcls.__name__, "pid": int(pid), "addr": srvaddr}
-        self.iLog("{}::_start_child END {}".format(self.__class__.__name__, new_srv))
-        return new_srv
+        return {"name": child_config.name, "plugin": child_config.plugin, "cls": srvcls.__name__, "pid": int(pid), "addr": srvaddr}
 
-    @ApiHandler.route("/stop_child")
+    # stop a child after its whole subtree, grandchildren are stopped in parallel
+    #   up to STOP_CONCURRENCY at a time on every level
+    #   a stop waits for a start of the same child in flight, so its unit is not removed while starting
+    @ApiHandler.route("/stop_child", limit=STOP_CONCURRENCY, timeout=60, lane="control", primary=True)
     async def _stop_child(self, headers: dict, data: dict):
 
-        self.iLog("{}::_stop_child BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_stop_child BEG %s", self.__class__.__name__, data)
         if "name" not in data:
-            self.eLog(f"Miss name in data {data}")
+            self.eLog("Miss name in data %s", data)
             return False
 
         child_name = data["name"]
+        async with self.getChildLock(child_name):
+            return await self.stopChild(child_name)
 
+    async def stopChild(self, child_name):
         elm = self.getChild(child_name)
         if not elm:
-            self.wLog("cannot find child server on {}".format(data))
+            self.wLog("cannot find child server on %s", child_name)
             return False
 
         self.delChild(child_name)
 
         if "addr" not in elm:
-            self.eLog("cannot find addr in elm {}".format(elm))
+            self.eLog("cannot find addr in elm %s", elm)
             return False
 
         child_addr = elm["addr"]
+        self.delFlow(f"{child_addr}/report/state?interval=1")
+        self._reports.remove(child_name)
 
-        res = await self.postJson(f"{child_addr}/get_info", {})
+        res, grand_children = await tornado.gen.multi([
+            self.postJson(f"{child_addr}/get_info", {}),
+            self.postJson(f"{child_addr}/get_children", {})
+        ])
         if res is None:
-            self.eLog("Exception request to {}/get_info".format(child_addr))
+            self.eLog("Exception request to %s/get_info", child_addr)
             return False
-
-        grand_children = await self.postJson(f"{child_addr}/get_children", {})
         if grand_children is None:
-            self.eLog("Exception request to {}/get_children".format(child_addr))
+            self.eLog("Exception request to %s/get_children", child_addr)
             return False
 
-        for grand_child in grand_children:
-            await tornado.gen.sleep(0.2)
-            res = await self.postJson(f"{child_addr}/stop_child", {"name":grand_child["name"]})
-            if res is None:
-                self.eLog("Exception request to {}/stop_child".format(child_addr))
-                return False
-
-        await tornado.gen.sleep(0.5)
+        sem = tornado.locks.Semaphore(STOP_CONCURRENCY)
+        async def stop_grand_child(name):
+            async with sem:
+                return await self.postJson(f"{child_addr}/stop_child", {"name": name})
+        results = await tornado.gen.multi([stop_grand_child(grand_child["name"]) for grand_child in grand_children])
+        if any(res is None for res in results):
+            self.eLog("Exception request to %s/stop_child", child_addr)
+            return False
 
-        rt = close_service(child_name)
-        self.iLog(f"delete service: {rt}")
+        rt = await self._services.closeService(child_name)
+        self.iLog("delete service: %s", rt)
+        if not await self.waitServer(child_addr, up=False):
+            self.wLog("child %s is still answering at %s", child_name, child_addr)
 
-        self.iLog("{}::_stop_child END".format(self.__class__.__name__))
+        self.iLog("%s::_stop_child END", self.__class__.__name__)
         return True
 
-    @ApiHandler.route("/clean_plugin")
+    @ApiHandler.route("/clean_plugin", serial=True)
     async def _clean_plugin(self, headers: dict, data: dict):
-        self.iLog("{}::_clean_plugin BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_clean_plugin BEG %s", self.__class__.__name__, data)
         if "plugin" not in data or not data["plugin"]:
-            self.wLog(f"Miss plugin in data {data}")
+            self.wLog("Miss plugin in data %s", data)
             return False
 
         srvapp = data["plugin"]
         pkgdir = f"{PLUGIN_PKG}.{srvapp}".replace('.', '/')
         if os.path.exists(pkgdir) and srvapp != "spawner":
             shutil.rmtree(pkgdir)
-            self.iLog(f"directory {pkgdir} is deleted")
+            self.iLog("directory %s is deleted", pkgdir)
         else:
             modfile = pkgdir + ".py"
             if os.path.isfile(modfile):
                 os.remove(modfile)
-                self.iLog(f"file {modfile} is deleted")
+                self.iLog("file %s is deleted", modfile)
             else:
-                self.iLog(f"file {modfile} doesnt exist")
+                self.iLog("file %s doesnt exist", modfile)
 
         mod = "{}.{}".format(PLUGIN_PKG, data["plugin"])
         if mod in sys.modules:
@@ -196,139 +419,207 @@ class Spawner(XSpawner): # NOQA
         if mod in sys.modules:
             del sys.modules[mod]
 
-        self.iLog("{}::_clean_plugin END".format(self.__class__.__name__))
+        self.iLog("%s::_clean_plugin END", self.__class__.__name__)
         return True
 
 
-    @ApiHandler.route("/download_plugin")
+    @ApiHandler.route("/download_plugin", lane="bulk")
     async def _download_plugin(self, headers: dict, data: dict):
-        self.iLog("{}::_download_plugin BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_download_plugin BEG %s", self.__class__.__name__, data)
         if "plugin" not in data or not data["plugin"]:
-            self.wLog(f"Miss plugin in data {data}")
+            self.wLog("Miss plugin in data %s", data)
             return False
         srvapp = data["plugin"]
         pkgdir = f"{PLUGIN_PKG}.{srvapp}".replace('.', '/')
         if os.path.exists(pkgdir):
             fname = srvapp + ".zip"
-            try:
-                zip_folder(pkgdir, fname, ["__pycache__", ".git", "logs"])
-                self.iLog(f"directory {pkgdir} is zipped to {fname}")
-                with open(fname, 'rb') as f:
-                    fdata = f.read()
-                self.dLog("{}::_download_plugin END {}".format(self.__class__.__name__, fname))
-                return (fdata, fname)
-            finally:
-                if os.path.exists(fname):
-                    os.unlink(fname)
+            # the zip is built while it is sent
+            fdata = self.streamSync(lambda writer: zip_folder(pkgdir, writer, ["__pycache__", ".git", "logs"]))
+            self.iLog("directory %s is zipped to %s", pkgdir, fname)
+            self.dLog("%s::_download_plugin END %s", self.__class__.__name__, fname)
+            return (fdata, fname)
         else:
             fname = pkgdir + ".py"
             if os.path.isfile(fname):
-                self.iLog(f"file {fname} is found")
-                with open(fname, 'rb') as f:
-                    fdata = f.read()
-                self.dLog("{}::_download_plugin END {}".format(self.__class__.__name__, fname))
-                return (fdata, fname)
+                self.iLog("file %s is found", fname)
+                self.dLog("%s::_download_plugin END %s", self.__class__.__name__, fname)
+                return (fname, fname)
             else:
-                self.wLog(f"file {fname} doesnt exist")
-        self.iLog("{}::_download_plugin END".format(self.__class__.__name__))
+                self.wLog("file %s doesnt exist", fname)
+        self.iLog("%s::_download_plugin END", self.__class__.__name__)
         return False
 
 
-    @ApiHandler.route("/upload_plugin")
-    async def _upload_plugin(self, headers: dict, fdata: bytes, fname: str, fargs: dict):
-        self.iLog("{}::_upload_plugin BEG {} {} {}".format(self.__class__.__name__, len(fdata), fname, fargs))
+    @ApiHandler.route("/upload_plugin", serial=True, timeout=30, lane="bulk", stream=True)
+    async def _upload_plugin(self, headers: dict, fdata: tempfile.SpooledTemporaryFile, fname: str, fargs: dict):
+        self.iLog("%s::_upload_plugin BEG %s %s", self.__class__.__name__, fname, fargs)
         if "plugin" in fargs:
             srvapp = data["plugin"]
         else:
             srvapp = os.path.splitext(os.path.basename(fname))[0]
         if get_file_type(fname) == "application/zip":
-            zip_buffer = io.BytesIO(fdata)
-            with zipfile.ZipFile(zip_buffer, 'r') as zipf:
-                zipf.extractall(PLUGIN_DIR)
-                self.iLog(f'exact {fname} to {PLUGIN_DIR}')
+            def unpack():
+                with zipfile.ZipFile(fdata, 'r') as zipf:
+                    zipf.extractall(PLUGIN_DIR)
+            await self.runSync(unpack)
+            self.iLog("exact %s to %s", fname, PLUGIN_DIR)
         else:
             modfile = f"{PLUGIN_DIR}/{fname}"
-            with open(modfile, "wb") as f:
-                f.write(fdata)
-                self.iLog(f'write to {modfile}')
-        self.iLog("{}::_upload_plugin END".format(self.__class__.__name__))
+            def save():
+                with open(modfile, "wb") as f:
+                    shutil.copyfileobj(fdata, f)
+            await self.runSync(save)
+            self.iLog("write to %s", modfile)
+        self.iLog("%s::_upload_plugin END", self.__class__.__name__)
         return True
 
 
-    @ApiHandler.route("/test_child")
+    @ApiHandler.route("/test_child", timeout=60, lane="bulk")
     async def _test_child(self, headers: dict, data: dict):
-        self.iLog("{}::_test_child BEG {}".format(self.__class__.__name__, data))
+        self.iLog("%s::_test_child BEG %s", self.__class__.__name__, data)
         if "plugin" not in data \
         or "port" not in data \
         or "name" not in data:
-            self.wLog(f"Miss plugin or port or name in data: {data}")
+            self.wLog("Miss plugin or port or name in data: %s", data)
             return True
         
         test_dir = "{}/{}/tests".format(PLUGIN_DIR, data["plugin"])
-        self.iLog("test_dir: {}".format(test_dir))
+        self.iLog("test_dir: %s", test_dir)
         if os.path.isdir(test_dir):
-            await tornado.gen.sleep(1)
-            if is_port_used(data["port"]):
+            srvaddr = "{}:{}".format(self.getHostAddr(), data["port"])
+            if await self.waitServer(srvaddr):
                 # run unittest
                 loader = unittest.TestLoader()
                 suite = loader.discover(start_dir=test_dir, top_level_dir=test_dir)
                 runner = unittest.TextTestRunner(failfast=True)
-                result = runner.run(suite)
-                self.iLog("unittest result {}".format(result))
+                result = await self.runSync(runner.run, suite)
+                self.iLog("unittest result %s", result)
                 if result.errors or result.failures:
-                    self.eLog("unittest upon server {}={} failed.".format(data["plugin"], data["name"]))
+                    self.eLog("unittest upon server %s=%s failed.", data["plugin"], data["name"])
                     return False
                 else:
                     self.iLog("unittest passed.")
             else:
-                self.wLog("server <:{}> is not running.".format(data["port"]))
+                self.wLog("server <:%s> is not running.", data["port"])
                 return False
         else:
             self.wLog("no unittest case.")
-        self.iLog("{}::_test_child END".format(self.__class__.__name__))
+        self.iLog("%s::_test_child END", self.__class__.__name__)
         return True
 
-    @ApiHandler.route("/get_info")
+    @ApiHandler.route("/get_info", reentrant=True, primary=True)
     async def _get_info(self, headers: dict, data: dict):
         return self.getInfo()
 
-    @FlowHandler.route("/report/state")
-    def _report_state(self, headers: dict, data: dict):
-        reports = self.getReports()
-        reports[self.getConfig().name] = self.getState().__json__()
+    # service status of every child from the status index
+    @ApiHandler.route("/get_services", reentrant=True, primary=True)
+    async def _get_services(self, headers: dict, data: dict):
+        return await self._services.getStatuses([child["name"] for child in self.getChildren()])
+
+    @ApiHandler.route("/get_metrics", reentrant=True, lane="control")
+    def _get_metrics(self, headers: dict, data: dict):
+        return self.getMetrics()
 
+    @ApiHandler.route("/get_routes", reentrant=True)
+    def _get_routes(self, headers: dict, data: dict):
+        return ApiHandler.routes()
+
+    def _snapshot_state(self, headers: dict, data: dict):
+        self.setReport({self.getConfig().name: self.getState().__json__()})
         evt = {
-            "event": "message",
-            "data": json.dumps(reports, separators=(',', ':'), ensure_ascii=False)
+            "event": "snapshot",
+            "data": codec.dumps(self.getReports())
         }
         return evt
 
-    def on_state(self, chunk):
+    # send the reports changed since the last event, and all of them every REPORT_SNAPSHOT events
+    #   new subscribers start from a snapshot
+    @FlowHandler.route("/report/state", broadcast=True, snapshot=_snapshot_state, primary=True)
+    def _report_state(self, headers: dict, data: dict):
+        self._report_ticks += 1
+        if self._report_ticks % REPORT_SNAPSHOT == 0:
+            evt = self._snapshot_state(headers, data)
+        else:
+            self.setReport({self.getConfig().name: self.getState().__json__()})
+            delta = self.getReportDelta(self._report_sent)
+            if not delta:
+                return None
+            evt = {
+                "event": "delta",
+                "data": codec.dumps(delta)
+            }
+        self._report_sent = self._reports.revision
+        return evt
+
+    def on_state(self, chunk, source=None):
         event = parse_sse_event(chunk.decode('utf-8'))
-        self.setReport(event["data"])
+        self.setReport(event["data"], source, snapshot=event["event"] == "snapshot")
 
+    # keep a flow connected until delFlow, cb gets every event as bytes
+    #   a dropped flow reconnects after a jittered exponential backoff and resumes from the last event id
     def addFlow(self, srvurl, cb):
-        self.iLog("{}::addFlow BEG {}".format(self.__class__.__name__, srvurl))
+        self.iLog("%s::addFlow BEG %s", self.__class__.__name__, srvurl)
+        if srvurl in self._subscriptions:
+            self.wLog("Flow %s is already added", srvurl)
+            return
+        self._subscriptions.add(srvurl)
         async def connect(srvurl):
-            client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
-            request = tornado.httpclient.HTTPRequest(
-                url=srvurl,
-                method="GET",
-                streaming_callback=cb,
-                request_timeout=0,
-                headers={
+            last_id = None
+            attempt = 0
+            buf = bytearray()
+            # chunks are split into whole events
+            def on_chunk(chunk):
+                nonlocal last_id, attempt
+                buf.extend(chunk)
+                while True:
+                    end = buf.find(b"\n\n")
+                    if end < 0:
+                        break
+                    evt = bytes(buf[:end + 2])
+                    del buf[:end + 2]
+                    for line in evt.split(b"\n"):
+                        if line.startswith(b"id:"):
+                            last_id = line[3:].strip().decode()
+                    attempt = 0
+                    cb(evt)
+            while srvurl in self._subscriptions:
+                headers = {
                     'Accept': 'text/event-stream',
                     'Cache-Control': 'no-cache'
                 }
-            )
-            try:
-                await client.fetch(request)
-            except Exception as e:
-                self.eLog('Flow {} is disconnected, exception {}:{}'.format(srvurl, e.__class__.__name__, e))
-            finally:
-                client.close()
+                if last_id is not None:
+                    headers['Last-Event-ID'] = last_id
+                buf.clear()
+                client = tornado.httpclient.AsyncHTTPClient(force_instance=True)
+                request = tornado.httpclient.HTTPRequest(
+                    url=srvurl,
+                    method="GET",
+                    streaming_callback=on_chunk,
+                    request_timeout=0,
+                    headers=headers
+                )
+                try:
+                    await client.fetch(request)
+                    self.wLog("Flow %s is closed by server", srvurl)
+                except Exception as e:
+                    self.eLog("Flow %s is disconnected, exception %s:%s", srvurl, e.__class__.__name__, e)
+                finally:
+                    client.close()
+                if srvurl not in self._subscriptions:
+                    break
+                delay = min(FLOW_RETRY_MAX, FLOW_RETRY_BASE * 2 ** attempt) * random.uniform(0.5, 1.0)
+                attempt = min(attempt + 1, 16)
+                self.iLog("Flow %s reconnects in %.2fs after event %s", srvurl, delay, last_id)
+                await tornado.gen.sleep(delay)
         self._ioloop.add_callback(connect, srvurl)
-        self.iLog("{}::addFlow END".format(self.__class__.__name__))
+        self.iLog("%s::addFlow END", self.__class__.__name__)
+
+    # stop reconnecting a flow, it is dropped at the next disconnection
+    def delFlow(self, srvurl):
+        self._subscriptions.discard(srvurl)
 
+    # _services controls the systemd units of children
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
+        self._services = get_service_control(self.getConfig().services)
+        self._ioloop.add_callback(self._services.keepRefreshing, SERVICE_REFRESH_INTERVAL)
@@ -0,0 +1,59 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2025 Song Feng.
+
+# benchmarks of a running server, they are not collected by the unittest discovery
+#   python -m xspawner.plugins.spawner.tests.bench <addr>
+
+import requests
+import sys
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+from xspawner.utilities import codec
+
+
+# return requests/sec of posting data to url from concurrent clients
+def bench(url, data, total=200, clients=8):
+    def run(n):
+        with requests.Session() as session:
+            for _ in range(n):
+                session.post(url, json=data)
+
+    t1 = time.time()
+    with ThreadPoolExecutor(clients) as pool:
+        list(pool.map(run, [total // clients] * clients))
+    t2 = time.time()
+    return (total // clients) * clients / (t2 - t1)
+
+
+def bench_dispatch(addr):
+    # /get_state is reentrant and called inline, /set_state is queued to the workers
+    direct = bench(f"{addr}/get_state", {})
+    queued = bench(f"{addr}/set_state", {})
+    print("dispatch direct {:.1f} req/s, queued {:.1f} req/s".format(direct, queued))
+
+
+def bench_codec():
+    # a /get_info like body with reports of 50 children
+    body = {
+        "name": "spawner", "plugin": "spawner", "port": 8668, "ssl": False,
+        "children": [{"name": f"child{i}", "addr": f"http://localhost:{9000 + i}"} for i in range(50)],
+        "reports": {f"child{i}": {"count": i, "load": i / 3, "tags": ["a", "b"]} for i in range(50)}
+    }
+    n = 2000
+    t1 = time.time()
+    for _ in range(n):
+        json.loads(json.dumps(body).encode().decode())
+    t2 = time.time()
+    for _ in range(n):
+        codec.loads(codec.dumpb(body))
+    t3 = time.time()
+    print("codec {} {:.1f} us/req, json {:.1f} us/req".format(codec.BACKEND, (t3 - t2) * 1e6 / n, (t2 - t1) * 1e6 / n))
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        print("Usage: python3 -m {} <addr>".format(__spec__.name))
+        sys.exit(1)
+    bench_dispatch(sys.argv[1])
+    bench_codec()
@@ -49,3 +49,15 @@ class Test(unittest.TestCase):
             raise ValueError("addr is None")
         rt = requests.get(f"{self.addr}/get_state")
         self.assertTrue(is_json(rt.text))
+
+    def test_upload_truncated(self):
+        if self.addr is None:
+            raise ValueError("addr is None")
+        # the closing delimiter is missing
+        body = b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="a.py"\r\n\r\nprint(1)\r\n'
+        rt = requests.post(f"{self.addr}/upload_plugin", data=body, headers={"Content-Type": "multipart/form-data; boundary=xyz"})
+        self.assertEqual(rt.status_code, 400)
+        # a form field which is not UTF-8 fails while the body is still streamed
+        body = b'--xyz\r\nContent-Disposition: form-data; name="plugin"\r\n\r\n\xff\xfe\r\n--xyz--\r\n'
+        rt = requests.post(f"{self.addr}/upload_plugin", data=body, headers={"Content-Type": "multipart/form-data; boundary=xyz"})
+        self.assertEqual(rt.status_code, 400)
@@ -0,0 +1,400 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2025 Song Feng.
+
+# in-process unit tests, they are kept out of the test*.py discovery of /test_child
+# so that a live server does not load their routes
+#   python -m unittest xspawner.plugins.spawner.tests.units
+
+import unittest
+import sys
+import os
+import tornado.testing
+import asyncio
+import tempfile
+import threading
+import logging
+import time
+import http.server
+import importlib.util
+import unittest.mock
+from xspawner.utilities import codec, log
+from xspawner.utilities.multipart import MultipartStreamParser
+from xspawner.utilities.pool import ConnectionPool
+from xspawner.utilities.msg import syncReq
+from xspawner.xspawner import Config, Flow, FlowChannel, State, XSpawner, ApiHandler
+from xspawner.constants import REQ_RETRY_AFTER
+from xspawner.service import get_service_control, ServiceControl, SERVICE_DIR
+from xspawner.plugins.spawner.spawner import ReportStore, Spawner
+
+
+# a queued route held by TestAdmission until its event is set, it is only registered during the test
+BUSY = {}
+
+async def _test_busy(self, headers: dict, data: dict):
+    await BUSY["event"].wait()
+    return True
+
+
+# an in-process server of one worker and one request per lane
+class TestAdmission(tornado.testing.AsyncHTTPTestCase):
+    def get_app(self):
+        config = Config(
+            name="admission_test", plugin="spawner", host="localhost", port=0, access="127.0.0.1",
+            ancestry="", reportup=False, log=False, severity="info", ssl=False, certfile="", keyfile="",
+            concurrency=1, queue=1, logqueue=0
+        )
+        ApiHandler.route("/test_busy", lane="bulk")(_test_busy)
+        self.server = XSpawner(config, State(), [])
+        self.instance, XSpawner._instance = XSpawner._instance, self.server
+        BUSY["event"] = asyncio.Event()
+        return self.server._server.request_callback
+
+    def tearDown(self):
+        BUSY["event"].set()
+        ApiHandler.path_map.pop("/test_busy", None)
+        XSpawner._instance = self.instance
+        self.server._executor.shutdown(wait=False)
+        super().tearDown()
+
+    def post(self, path):
+        return self.http_client.fetch(self.get_url(path), method="POST", body="{}", raise_error=False)
+
+    async def admitted(self, n):
+        while self.server._req_stats["admitted"] < n:
+            await asyncio.sleep(0.01)
+
+    @tornado.testing.gen_test
+    async def test_full_lane_is_rejected(self):
+        # the worker holds the first request and the second one fills the bulk lane
+        first = self.post("/test_busy")
+        await self.admitted(1)
+        second = self.post("/test_busy")
+        await self.admitted(2)
+        rt = await self.post("/test_busy")
+        self.assertEqual(rt.code, 503)
+        self.assertEqual(rt.headers["Retry-After"], str(REQ_RETRY_AFTER))
+        self.assertEqual(self.server._req_stats["rejected"], 1)
+        BUSY["event"].set()
+        self.assertEqual([(await first).code, (await second).code], [200, 200])
+
+    def test_lanes_are_ordered(self):
+        route = ApiHandler.path_map["/test_busy"]
+        for lane in ("bulk", "normal", "control"):
+            self.assertTrue(self.server.enqueue(route._replace(lane=lane), lane))
+        lanes = [self.server._req_queue.get_nowait()[2] for _ in range(3)]
+        self.assertEqual(lanes, ["control", "normal", "bulk"])
+
+
+# a server standing in for XSpawner in in-process tests, it only logs
+class LogServer:
+    def dLog(self, msg, *args): pass
+    def iLog(self, msg, *args): pass
+    def wLog(self, msg, *args): pass
+    def eLog(self, msg, *args): pass
+
+
+class TestFlowChannel(unittest.IsolatedAsyncioTestCase):
+    def makeChannel(self, snapshot=None):
+        async def fun(server, headers, args):
+            await asyncio.Event().wait()
+            yield
+        flow = Flow("/flow", fun, (), True, 1, 16, False, 0, 64, snapshot)
+        return FlowChannel(flow, LogServer())
+
+    def publish(self, channel, n):
+        for i in range(n):
+            channel.publish(channel.encode({"event": "message", "data": i}))
+
+    async def asyncTearDown(self):
+        for task in asyncio.all_tasks() - {asyncio.current_task()}:
+            task.cancel()
+
+    def drain(self, queue):
+        return [queue.get_nowait() for _ in range(queue.qsize())]
+
+    async def test_resume(self):
+        channel = self.makeChannel(lambda server, headers, args: {"event": "snapshot", "data": "all"})
+        self.publish(channel, 5)
+        last_id = channel.history[1][0]
+        chunks = self.drain(channel.subscribe(last_id))
+        self.assertEqual(chunks, [chunk for _, chunk in list(channel.history)[2:]])
+        self.assertEqual(channel.stats["snapshots"], 0)
+
+    async def test_restart_gets_snapshot(self):
+        # the server restarted and kept nothing, the client's id is from its previous run
+        channel = self.makeChannel(lambda server, headers, args: {"event": "snapshot", "data": "all"})
+        chunks = self.drain(channel.subscribe(12345))
+        self.assertEqual(len(chunks), 1)
+        self.assertIn(b"event: snapshot", chunks[0])
+        # ids of a previous run or ahead of the history cannot resume either
+        self.publish(channel, 3)
+        for last_id in (channel.history[0][0] - 100, channel.history[-1][0] + 100):
+            chunks = self.drain(channel.subscribe(last_id))
+            self.assertEqual(len(chunks), 1)
+            self.assertIn(b"event: snapshot", chunks[0])
+
+    async def test_unknown_id_gets_backlog(self):
+        channel = self.makeChannel()
+        self.publish(channel, 3)
+        chunks = self.drain(channel.subscribe(channel.history[-1][0] + 100))
+        self.assertEqual(chunks, [chunk for _, chunk in channel.history])
+
+    async def test_idle_producer_stops(self):
+        # the flow waits forever for its first event, its producer stops with the last subscriber
+        channel = self.makeChannel()
+        first, second = channel.subscribe(), channel.subscribe()
+        producer = channel.producer
+        channel.unsubscribe(first)
+        await asyncio.sleep(0)
+        self.assertFalse(producer.done())
+        channel.close(second)
+        await asyncio.wait([producer], timeout=1)
+        self.assertTrue(producer.cancelled())
+        self.assertIsNone(channel.producer)
+        # a new subscriber starts a new producer
+        channel.subscribe()
+        self.assertIsNotNone(channel.producer)
+        self.assertIsNot(channel.producer, producer)
+
+
+class TestReportStore(unittest.TestCase):
+    def test_snapshot_replaces_source(self):
+        store = ReportStore()
+        store.replace({"child": {"n": 1}, "grand1": {"n": 2}, "grand2": {"n": 3}}, "child")
+        store.set("other", {"n": 4}, "other")
+        revision = store.revision
+        # grand2 is gone from the next snapshot of child
+        store.replace({"child": {"n": 1}, "grand1": {"n": 5}}, "child")
+        self.assertEqual(store.reports, {"child": {"n": 1}, "grand1": {"n": 5}, "other": {"n": 4}})
+        self.assertEqual(store.delta(revision), {"grand1": {"n": 5}, "grand2": None})
+
+    def test_delta_keeps_names(self):
+        store = ReportStore()
+        store.replace({"child": {"n": 1}, "grand1": {"n": 2}}, "child")
+        store.set("child", {"n": 6}, "child")
+        self.assertEqual(store.reports, {"child": {"n": 6}, "grand1": {"n": 2}})
+
+
+class TestChildLocks(unittest.IsolatedAsyncioTestCase):
+    async def test_lock_is_dropped(self):
+        spawner = Spawner.__new__(Spawner)
+        order = []
+        async def stop():
+            async with spawner.getChildLock("lock_test"):
+                order.append("stop")
+        async with spawner.getChildLock("lock_test"):
+            # a stop waiting for the start holds the same lock
+            stopping = asyncio.ensure_future(stop())
+            await asyncio.sleep(0)
+            order.append("start")
+        await stopping
+        self.assertEqual(order, ["start", "stop"])
+        self.assertNotIn("lock_test", Spawner._child_locks)
+
+
+class TestCodec(unittest.TestCase):
+    # a fresh codec module with the standard json backend
+    def loadFallback(self):
+        spec = importlib.util.spec_from_file_location("codec_fallback", codec.__file__)
+        module = importlib.util.module_from_spec(spec)
+        with unittest.mock.patch.dict(sys.modules, {"orjson": None}):
+            spec.loader.exec_module(module)
+        return module
+
+    def test_namedtuple_is_object(self):
+        config = Config(
+            name="child", plugin="supervisor", host="localhost", port=18790, access="127.0.0.1",
+            ancestry="", reportup=False, log=False, severity="info", ssl=False, certfile="", keyfile=""
+        )
+        body = {"config": config, "children": [config]}
+        expected = {"config": config._asdict(), "children": [config._asdict()]}
+        fallback = self.loadFallback()
+        self.assertEqual(fallback.BACKEND, "json")
+        for module in (codec, fallback):
+            self.assertEqual(module.loads(module.dumps(body)), expected)
+        if codec.packb:
+            self.assertEqual(codec.unpackb(codec.packb(body)), expected)
+
+    @unittest.skipUnless(codec.packb, "msgpack is not installed")
+    def test_int_keys(self):
+        body = {1: "a", "b": {2: [3]}}
+        self.assertEqual(codec.unpackb(codec.packb(body)), body)
+
+
+class TestFakeControl(unittest.IsolatedAsyncioTestCase):
+    async def test_lifecycle(self):
+        control = get_service_control("fake")
+        control.unit_dir = tempfile.mkdtemp()
+        config = Config(
+            name="fake_unit_test", plugin="supervisor", host="localhost", port=18790, access="127.0.0.1",
+            ancestry="", reportup=False, log=False, severity="info", ssl=False, certfile="", keyfile=""
+        )
+        unit_file = f"{control.unit_dir}/{config.name}.service"
+        rts = await control.prepareServices([config])
+        self.assertTrue(rts[0]["success"], rts[0]["info"])
+        self.assertTrue(os.path.isfile(unit_file))
+        self.assertFalse(os.path.exists(f"{SERVICE_DIR}/{config.name}.service"))
+
+        self.assertTrue(await control.start(config.name))
+        status = await control.getStatus(config.name)
+        self.assertEqual(status["active"], "active")
+        self.assertGreater(int(status["pid"]), 0)
+
+        self.assertTrue(await control.stop(config.name))
+        status = await control.getStatus(config.name)
+        self.assertEqual(status["active"], "inactive")
+
+        rt = await control.closeService(config.name)
+        self.assertTrue(rt["success"], rt["info"])
+        self.assertFalse(os.path.exists(unit_file))
+        os.rmdir(control.unit_dir)
+
+
+# a systemctl answering show slowly, every service runs with pid of its name's length
+class SlowControl(ServiceControl):
+    async def systemctl(self, *args):
+        await asyncio.sleep(0.05)
+        names = [arg[:-len(".service")] for arg in args[1:] if arg.endswith(".service")]
+        blocks = [f"Id={name}.service\nLoadState=loaded\nActiveState=active\nSubState=running\nMainPID={len(name)}\n" for name in names]
+        return 0, "\n".join(blocks), ""
+
+
+class TestServiceControl(unittest.IsolatedAsyncioTestCase):
+    async def test_concurrent_lookups(self):
+        # b is asked for while the refresh of a is running
+        control = SlowControl()
+        a, b = await asyncio.gather(control.getStatus("a"), control.getStatus("bb"))
+        self.assertEqual((a["pid"], a["active"]), ("1", "active"))
+        self.assertEqual((b["pid"], b["active"]), ("2", "active"))
+        self.assertEqual(control.stats["refreshes"], 2)
+
+
+class TestJsonHTTPHandler(unittest.TestCase):
+    # posts fail while fails is positive and wait while hold is clear
+    def setUp(self):
+        self.bodies = []
+        self.fails = 0
+        self.fetching = threading.Event()
+        self.hold = threading.Event()
+        self.hold.set()
+        patches = [
+            unittest.mock.patch.object(log, "fetch_sync", self.fetch),
+            unittest.mock.patch.object(log, "LOG_RETRY_BASE", 0.000001),
+            unittest.mock.patch.object(log, "LOG_RETRY_MAX", 0.000001)
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def fetch(self, url, method, body, headers):
+        self.fetching.set()
+        self.hold.wait()
+        if self.fails > 0:
+            self.fails -= 1
+            raise ConnectionError("recorder is down")
+        self.bodies.append(body)
+
+    def makeHandler(self, **kwargs):
+        handler = log.JsonHTTPHandler("http://localhost:1/queue", flush_interval=0.01, **kwargs)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        return handler
+
+    def emit(self, handler, *msgs):
+        for msg in msgs:
+            handler.emit(logging.LogRecord("test", logging.INFO, __file__, 0, msg, None, None))
+
+    def test_batches(self):
+        handler = self.makeHandler(batch_size=3)
+        self.emit(handler, *"abcdefg")
+        handler.close()
+        self.assertEqual(b"".join(self.bodies), b"a\nb\nc\nd\ne\nf\ng\n")
+        self.assertTrue(all(body.count(b"\n") <= 3 for body in self.bodies))
+        self.assertEqual(handler.getStats()["sent"], 7)
+
+    def test_retry_without_overflow(self):
+        # far more failures than the backoff exponent can take
+        self.fails = 1100
+        handler = self.makeHandler(batch_format="json")
+        self.emit(handler, '"a"', '"b"')
+        deadline = time.time() + 10
+        while not self.bodies and handler.worker.is_alive() and time.time() < deadline:
+            time.sleep(0.01)
+        handler.close()
+        self.assertEqual(self.bodies, [b'["a","b"]'])
+        self.assertEqual(handler.getStats()["retries"], 1100)
+
+    def test_drop_oldest(self):
+        # the worker is held on the first record while the buffer of 2 overflows
+        self.hold.clear()
+        handler = self.makeHandler(batch_size=1, capacity=2)
+        self.emit(handler, "a")
+        self.fetching.wait(1)
+        self.emit(handler, "b", "c", "d")
+        self.hold.set()
+        handler.close()
+        self.assertEqual(self.bodies, [b"a\n", b"c\n", b"d\n"])
+        self.assertEqual(handler.getStats()["dropped"], 1)
+
+
+class TestMultipart(unittest.TestCase):
+    def test_header_not_utf8(self):
+        parser = MultipartStreamParser(b"xyz")
+        parser.feed(b'--xyz\r\nContent-Disposition: form-data; name="file"; filename="\xff.py"\r\n\r\nprint(1)')
+        parser.feed(b'\r\n--xyz--\r\n')
+        parser.close()
+        fdata, fname, fargs = parser.result()
+        self.assertEqual((fname, fdata.read()), ("\ufffd.py", b"print(1)"))
+
+
+# /moved redirects to /echo, which answers the method and body it got
+class EchoHandler(http.server.BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = self.rfile.read(int(self.headers.get("Content-Length", 0)))
+        if self.path == "/moved":
+            self.send_response(302)
+            self.send_header("Location", "/echo")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+        reply = self.command.encode() + b" " + body
+        self.send_response(200)
+        self.send_header("Content-Length", str(len(reply)))
+        self.end_headers()
+        self.wfile.write(reply)
+
+    do_POST = do_GET
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestConnectionPool(unittest.TestCase):
+    def setUp(self):
+        self.server = http.server.ThreadingHTTPServer(("127.0.0.1", 0), EchoHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.url = "http://127.0.0.1:{}".format(self.server.server_port)
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def test_sync_req_options(self):
+        self.assertEqual(syncReq(f"{self.url}/echo", "POST", "x", connect_timeout=1, validate_cert=False), "POST x")
+        # a POST redirected by 302 is followed as a GET
+        self.assertEqual(syncReq(f"{self.url}/moved", "POST", "x"), "GET ")
+        self.assertIsNone(syncReq(f"{self.url}/moved", "POST", "x", follow_redirects=False))
+
+    def test_redirects(self):
+        pool = ConnectionPool()
+        res = pool.fetch(f"{self.url}/moved", method="POST", body="x", follow_redirects=False, raise_error=False)
+        self.assertEqual(res.code, 302)
+        res = pool.fetch(f"{self.url}/moved")
+        self.assertEqual((res.code, res.effective_url), (200, f"{self.url}/echo"))
+        res = pool.fetch(f"{self.url}/moved", max_redirects=0, raise_error=False)
+        self.assertEqual(res.code, 302)
+
+    def test_unsupported_option(self):
+        with self.assertRaisesRegex(TypeError, "proxy_host"):
+            ConnectionPool().fetch(f"{self.url}/echo", proxy_host="localhost")
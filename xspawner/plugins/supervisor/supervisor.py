@@ -109,7 +109,7 @@ class Supervisor(Spawner): # NOQA
                 return False
             return True
 
-        self.iLog("{}::_create BEG".format(self.__class__.__name__))
+        self.iLog("%s::_create BEG", self.__class__.__name__)
         set_env(title="服务创建", output_animation=False)
         put_html(f'<style>{CSS}</style>')
         data = await input_group(
@@ -215,16 +215,16 @@ class Supervisor(Spawner): # NOQA
             return
 
         topmod = srvcls.__module__
-        self.dLog(f"topmod: {topmod}")
+        self.dLog("topmod: %s", topmod)
         if len(topmod.split(".")) <= 2: 
             put_error('Wrong mod path {}!'.format(topmod))
             return
 
         srvapp = topmod.split(".")[2]
-        self.iLog(f"srvapp: {srvapp}")
+        self.iLog("srvapp: %s", srvapp)
 
         # start child and get its pid
-        res = await self._start_child(None, {"name": srvname, "plugin": srvapp, "port": srvport, "severity": srvseverity})
+        res = await self.callRoute("/start_child", {"name": srvname, "plugin": srvapp, "port": srvport, "severity": srvseverity})
         if not res: # res is False
             put_error("Failed to start server {}.".format(srvname))
             return
@@ -237,7 +237,7 @@ class Supervisor(Spawner): # NOQA
             if not await self._test_child(None, {"name": srvname, "plugin": srvapp, "port": srvport}):
                 put_error("Unittest failed!")
                 if is_port_used(srvport):
-                    if await self._stop_child(None, {"name": srvname}):
+                    if await self.callRoute("/stop_child", {"name": srvname}):
                         put_warning("server {} was stopped.".format(srvname))
                         if srvapp not in ["spawner", "supervisor"]:
                             if await self._clean_plugin(None, {"plugin": srvapp}):
@@ -245,7 +245,7 @@ class Supervisor(Spawner): # NOQA
                 return
 
         put_success("Server <{} :{}> is loaded to port {} successfully.".format(srvname, res["pid"], srvport))
-        self.iLog("{}::_create END".format(self.__class__.__name__))
+        self.iLog("%s::_create END", self.__class__.__name__)
 
 
     @UiHandler.route("/delete")
@@ -266,7 +266,7 @@ class Supervisor(Spawner): # NOQA
             with popup('选择已运行的服务'):
                 put_buttons(srv_names, onclick=set_value_and_close_popup, outline=True)
 
-        self.iLog("{}::_delete BEG".format(self.__class__.__name__))
+        self.iLog("%s::_delete BEG", self.__class__.__name__)
         set_env(title="服务销毁", output_animation=False)
         put_html(f'<style>{CSS}</style>')
         data = await input_group(
@@ -289,21 +289,21 @@ class Supervisor(Spawner): # NOQA
 
         res = await self.postJson(f"{srvaddr}/get_info", {})
         if res is None:
-            self.eLog("Exception when postJson to {}/get_info".format(srvaddr))
+            self.eLog("Exception when postJson to %s/get_info", srvaddr)
             put_error("Exception when postJson to {}/get_info".format(srvaddr))
             return
 
         srvpid = res["pid"]
         srvapp = res["plugin"]
         put_info("Server <{} :{}> will be deleted.".format(srvname, srvpid))
-        if await self._stop_child(None, {"name": srvname}):
+        if await self.callRoute("/stop_child", {"name": srvname}):
             put_success("Server <{} :{}> is deleted.".format(srvname, srvpid))
             if srvapp not in ["spawner", "supervisor"]:
                 if await self._clean_plugin(None, {"plugin": srvapp}):
                     put_success("Plugin {} is cleaned.".format(srvapp))
-                    self.iLog("Plugin {} is cleaned.".format(srvapp))
+                    self.iLog("Plugin %s is cleaned.", srvapp)
 
-        self.iLog("{}::_delete END".format(self.__class__.__name__))
+        self.iLog("%s::_delete END", self.__class__.__name__)
 
 
     @UiHandler.route("/log")
@@ -329,7 +329,7 @@ class Supervisor(Spawner): # NOQA
                 ldata = locals().copy()
                 del ldata["self"]
                 if ldata:
-                    self.iLog("local vars: {}".format(str(ldata)))
+                    self.iLog("local vars: %s", ldata)
                     put_markdown("***\n变量值")
                     put_code(get_first_level_json(ldata), language='json')
             self.iLog("_debug_output END")
@@ -403,13 +403,13 @@ class Supervisor(Spawner): # NOQA
                 await tornado.gen.sleep(0.2)
                 await show_form(data)
 
-        self.dLog("{}::_debug BEG".format(self.__class__.__name__))
+        self.dLog("%s::_debug BEG", self.__class__.__name__)
         set_env(title="调试接口", output_animation=False)
 
         # 显示表单
         put_scope("form_scope")
         await show_form({'code':'put_text("Hello world!")\n','func':'UI'})
-        self.dLog("{}::_debug END".format(self.__class__.__name__))
+        self.dLog("%s::_debug END", self.__class__.__name__)
 
 
     def __init__(self, **kwargs):
@@ -3,12 +3,20 @@ import sys
 import subprocess
 import psutil
 import json
+import time
+import shlex
+import signal
+import asyncio
+import tempfile
 
 from typing import Optional, Dict, Any
 from xspawner.xspawner import Config, parse_ancestry
+from xspawner.constants import SERVICE_BACKEND, SERVICE_STATUS_TTL, LOG_QUEUE_SIZE
 
 WORKING_DIR = "/opt/xspawner"
 SERVICE_DIR = "/etc/systemd/system"
+# FakeControl 的单元文件目录，不需要 root 权限，也不改动主机的 systemd
+FAKE_SERVICE_DIR = os.path.join(tempfile.gettempdir(), "xspawner-units")
 SERVICE_TMPL = """
 [Unit]
 Description={} service
@@ -20,7 +28,6 @@ PartOf={}
 Type=simple
 WorkingDirectory={}
 
-ExecStartPre=/bin/sleep 1.0s
 ExecStart={}
 Restart=on-failure
 
@@ -46,27 +53,49 @@ def get_service_status(service_name: str) -> Dict[str, Any]:
             check=False
         )
 
-        status = {}
-        for line in result.stdout.split('\n'):
-            if '=' in line:
-                key, value = line.split('=', 1)
-                status[key] = value
-
-        return {
-            'name': service_name,
-            'active': status.get('ActiveState', 'unknown'),
-            'status': status.get('SubState', 'unknown'),
-            'loaded': status.get('LoadState', 'unknown'),
-            'pid': status.get('MainPID', '0'),
-            'memory': status.get('MemoryCurrent', '0'),
-            'cpu': status.get('CPUUsageNSec', '0')
-        }
+        return parse_service_show(service_name, result.stdout)
 
     except Exception as e:
         print(f"Failed to get service status: {e}")
         return {'name': service_name, 'error': str(e)}
 
 
+# systemctl show 只查询这些属性
+SERVICE_PROPERTIES = ["Id", "LoadState", "ActiveState", "SubState", "MainPID", "MemoryCurrent", "CPUUsageNSec"]
+
+def parse_service_shows(output: str) -> Dict[str, Dict[str, Any]]:
+    """解析多个单元的 systemctl show 输出，各单元以空行分隔，以 Id 区分"""
+    statuses = {}
+    for block in output.split('\n\n'):
+        for line in block.split('\n'):
+            if line.startswith('Id='):
+                service_name = line[3:].strip()
+                if service_name.endswith('.service'):
+                    service_name = service_name[:-len('.service')]
+                statuses[service_name] = parse_service_show(service_name, block)
+                break
+    return statuses
+
+
+def parse_service_show(service_name: str, output: str) -> Dict[str, Any]:
+    """解析 systemctl show 的输出"""
+    status = {}
+    for line in output.split('\n'):
+        if '=' in line:
+            key, value = line.split('=', 1)
+            status[key] = value
+
+    return {
+        'name': service_name,
+        'active': status.get('ActiveState', 'unknown'),
+        'status': status.get('SubState', 'unknown'),
+        'loaded': status.get('LoadState', 'unknown'),
+        'pid': status.get('MainPID', '0'),
+        'memory': status.get('MemoryCurrent', '0'),
+        'cpu': status.get('CPUUsageNSec', '0')
+    }
+
+
 def reload_systemd() -> bool:
     """重新加载 systemd"""
     try:
@@ -175,6 +204,17 @@ def get_exec_cmd(config: Config) -> str:
 
     # add log options
     cmd += " --log --severity {}".format(config.severity)
+    if config.logqueue != LOG_QUEUE_SIZE:
+        cmd += " --logqueue {}".format(config.logqueue)
+    if config.recorder:
+        cmd += " --recorder {}".format(config.recorder)
+
+    # add concurrency, queue, workers and threads options
+    cmd += " --concurrency {} --queue {} --workers {} --threads {}".format(config.concurrency, config.queue, config.workers, config.threads)
+
+    # add service control option
+    if config.services != SERVICE_BACKEND:
+        cmd += " --services {}".format(config.services)
 
     # add ssl options
     if config.ssl and config.certfile and config.keyfile:
@@ -244,6 +284,42 @@ def open_service(config: Config) -> dict:
         return rt
 
 
+def write_service_files(configs: list, unit_dir: str = SERVICE_DIR) -> list:
+    """写入多个 systemd service 文件到 unit_dir"""
+    rts = [{"success": True, "info": ""} for _ in configs]
+    try:
+        os.makedirs(unit_dir, exist_ok=True)
+    except Exception as e:
+        return [{"success": False, "info": f"Exception occurred when creating {unit_dir}: {e}"} for _ in configs]
+
+    for config, rt in zip(configs, rts):
+        try:
+            service_path = f"{unit_dir}/{config.name}.service"
+            with open(service_path, 'w') as f:
+                f.write(generate_service_file(config))
+            rt["info"] += f"Wrote service file {service_path}; "
+        except Exception as e:
+            rt["info"] += f"Exception occurred when writing service file: {e}"
+            rt["success"] = False
+    return rts
+
+
+def check_prepared_services(rts: list, reloaded: bool, enabled: bool) -> list:
+    """记录重新加载和启用的结果"""
+    for rt in rts:
+        if not rt["success"]:
+            continue
+        if not reloaded:
+            rt["info"] += "Failed to reload systemd!"
+            rt["success"] = False
+        elif not enabled:
+            rt["info"] += "Failed to enable services!"
+            rt["success"] = False
+        else:
+            rt["info"] += "Reloaded systemd and enabled service; "
+    return rts
+
+
 def close_service(service_name) -> dict:
     """移除 systemd service 文件"""
     rt = {"success": True, "info": ""}
@@ -331,6 +407,277 @@ def is_running_by_psutil(proc_name: str):
 
 
 
+class ServiceControl:
+    """异步服务控制接口，子类实现 systemctl
+    查询过的服务被加入状态索引，一次 systemctl show 刷新所有服务的状态，状态缓存 ttl 秒
+    单元文件写在 unit_dir 中"""
+
+    unit_dir = SERVICE_DIR
+
+    def __init__(self, ttl: float = SERVICE_STATUS_TTL):
+        self.ttl = ttl
+        self._status = {}
+        self._watched = set()
+        self._refreshed = 0.0
+        self._refreshing = None
+        self._querying = set()
+        self.stats = {"refreshes": 0, "hits": 0, "misses": 0}
+
+    async def systemctl(self, *args) -> tuple:
+        """执行 systemctl 命令，返回 (returncode, stdout, stderr)"""
+        raise NotImplementedError
+
+    async def call(self, *args) -> bool:
+        code, out, err = await self.systemctl(*args)
+        if code != 0:
+            print(f"systemctl {' '.join(args)} failed: {err}")
+        return code == 0
+
+    def invalidate(self, *service_names):
+        for service_name in service_names:
+            self._status.pop(service_name, None)
+
+    def unwatch(self, *service_names):
+        self._watched.difference_update(service_names)
+        self.invalidate(*service_names)
+
+    async def refresh(self, service_names=()):
+        """一次 systemctl show 刷新索引中所有服务的状态，同时的调用共用同一次刷新
+        正在进行的刷新没有查询 service_names 中的服务时，等它结束后再刷新一次"""
+        while self._refreshing:
+            refreshing, querying = self._refreshing, self._querying
+            await refreshing
+            if querying.issuperset(service_names):
+                return
+        self._refreshing = asyncio.get_running_loop().create_future()
+        self._querying = set(self._watched)
+        try:
+            service_names = sorted(self._querying)
+            if service_names:
+                code, out, err = await self.systemctl(
+                    "show", "--no-page", "--property=" + ",".join(SERVICE_PROPERTIES),
+                    *[f"{service_name}.service" for service_name in service_names]
+                )
+                statuses = parse_service_shows(out)
+                self._status = {
+                    service_name: statuses.get(service_name) or parse_service_show(service_name, "")
+                    for service_name in service_names
+                }
+            self._refreshed = time.monotonic()
+            self.stats["refreshes"] += 1
+        finally:
+            refreshing, self._refreshing = self._refreshing, None
+            refreshing.set_result(None)
+
+    async def keepRefreshing(self, interval: float):
+        """后台定期刷新状态索引"""
+        while True:
+            try:
+                if self._watched:
+                    await self.refresh()
+            except Exception as e:
+                print(f"Failed to refresh service status: {e}")
+            await asyncio.sleep(interval)
+
+    async def getStatuses(self, service_names: list) -> Dict[str, Dict[str, Any]]:
+        """获取多个服务状态，优先使用缓存"""
+        self._watched.update(service_names)
+        fresh = time.monotonic() - self._refreshed < self.ttl
+        if fresh and all(service_name in self._status for service_name in service_names):
+            self.stats["hits"] += 1
+        else:
+            self.stats["misses"] += 1
+            await self.refresh(service_names)
+        return {
+            service_name: self._status.get(service_name) or parse_service_show(service_name, "")
+            for service_name in service_names
+        }
+
+    async def getStatus(self, service_name: str) -> Dict[str, Any]:
+        """获取服务状态，优先使用缓存"""
+        return (await self.getStatuses([service_name]))[service_name]
+
+    async def reload(self) -> bool:
+        return await self.call("daemon-reload")
+
+    async def start(self, service_name: str) -> bool:
+        self.invalidate(service_name)
+        return await self.call("start", service_name)
+
+    async def stop(self, service_name: str) -> bool:
+        self.invalidate(service_name)
+        return await self.call("stop", service_name)
+
+    async def restart(self, service_name: str) -> bool:
+        self.invalidate(service_name)
+        return await self.call("restart", service_name)
+
+    async def enable(self, *service_names) -> bool:
+        return await self.call("enable", "--no-reload", *service_names)
+
+    async def disable(self, *service_names) -> bool:
+        return await self.call("disable", "--no-reload", *service_names)
+
+    async def openService(self, config: Config) -> dict:
+        """写入 systemd service 文件并启动服务"""
+        rt = write_service_files([config], self.unit_dir)[0]
+        if not rt["success"]:
+            return rt
+        if not await self.reload():
+            rt["info"] += "Failed to reload systemd!"
+            rt["success"] = False
+            return rt
+        rt["info"] += "Reloaded systemd! "
+        if not await self.enable(config.name):
+            rt["info"] += f"Failed to enable {config.name} service!"
+            rt["success"] = False
+            return rt
+        if not await self.start(config.name):
+            rt["info"] += f"Failed to start {config.name} service!"
+            rt["success"] = False
+            return rt
+        rt["info"] += f"Started {config.name} service successfully"
+        return rt
+
+    async def prepareServices(self, configs: list) -> list:
+        """批量写入 systemd service 文件，只重新加载一次 systemd 并启用服务，不启动服务"""
+        rts = write_service_files(configs, self.unit_dir)
+        names = [config.name for config, rt in zip(configs, rts) if rt["success"]]
+        if not names:
+            return rts
+        reloaded = await self.reload()
+        enabled = reloaded and await self.enable(*names)
+        return check_prepared_services(rts, reloaded, enabled)
+
+    async def closeService(self, service_name: str) -> dict:
+        """停止服务并移除 systemd service 文件"""
+        rt = {"success": True, "info": ""}
+        try:
+            await self.stop(service_name)
+            rt["info"] += f"Stopped service {service_name}; "
+            await self.disable(service_name)
+            rt["info"] += f"Disabled service {service_name}; "
+            service_path = f"{self.unit_dir}/{service_name}.service"
+            if os.path.exists(service_path):
+                os.unlink(service_path)
+                rt["info"] += f"Deleted service file {service_name}; "
+            await self.reload()
+            rt["info"] += f"Reloaded service {service_name}; "
+            self.unwatch(service_name)
+            return rt
+        except Exception as e:
+            rt["info"] += f"Exception occurred when removing service: {e}"
+            rt["success"] = False
+            return rt
+
+
+class SystemctlControl(ServiceControl):
+    """通过 asyncio 子进程调用 systemctl，不阻塞事件循环"""
+
+    async def systemctl(self, *args) -> tuple:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                "systemctl", *args,
+                stdout=asyncio.subprocess.PIPE,
+                stderr=asyncio.subprocess.PIPE
+            )
+            out, err = await proc.communicate()
+            return proc.returncode, out.decode(), err.decode()
+        except OSError as e:
+            return 127, "", str(e)
+
+
+class FakeControl(ServiceControl):
+    """本地模拟 systemd，用于没有 systemd 的测试：读取 unit_dir 中的单元文件，以子进程直接运行 ExecStart
+    unit_dir 默认为临时目录下的 FAKE_SERVICE_DIR"""
+
+    def __init__(self, ttl: float = SERVICE_STATUS_TTL, unit_dir: str = FAKE_SERVICE_DIR):
+        super().__init__(ttl)
+        self.unit_dir = unit_dir
+        self._enabled = set()
+        self._procs = {}
+
+    def readUnit(self, service_name: str) -> Optional[dict]:
+        service_path = f"{self.unit_dir}/{service_name}.service"
+        if not os.path.isfile(service_path):
+            return None
+        unit = {}
+        with open(service_path, 'r') as f:
+            for line in f:
+                if '=' in line:
+                    key, value = line.strip().split('=', 1)
+                    unit[key] = value
+        return unit
+
+    def isRunning(self, service_name: str) -> bool:
+        proc = self._procs.get(service_name)
+        return proc is not None and proc.returncode is None
+
+    async def systemctl(self, *args) -> tuple:
+        op = args[0]
+        names = [arg for arg in args[1:] if not arg.startswith("--")]
+        if op == "daemon-reload":
+            return 0, "", ""
+        names = [name[:-len(".service")] if name.endswith(".service") else name for name in names]
+        if op == "show":
+            blocks = []
+            for name in names:
+                running = self.isRunning(name)
+                blocks.append("Id={}.service\nLoadState={}\nActiveState={}\nSubState={}\nMainPID={}\n".format(
+                    name,
+                    "loaded" if self.readUnit(name) else "not-found",
+                    "active" if running else "inactive",
+                    "running" if running else "dead",
+                    self._procs[name].pid if running else 0
+                ))
+            return 0, "\n".join(blocks), ""
+        missing = [name for name in names if op != "stop" and self.readUnit(name) is None]
+        if missing:
+            return 5, "", f"Unit {' '.join(missing)}.service not found."
+        for name in names:
+            if op == "enable":
+                self._enabled.add(name)
+            elif op == "disable":
+                self._enabled.discard(name)
+            elif op in ("stop", "restart"):
+                await self.kill(name)
+            if op in ("start", "restart") and not self.isRunning(name):
+                unit = self.readUnit(name)
+                cwd = unit.get("WorkingDirectory")
+                self._procs[name] = await asyncio.create_subprocess_exec(
+                    *shlex.split(unit["ExecStart"]),
+                    cwd=cwd if cwd and os.path.isdir(cwd) else None,
+                    stdout=asyncio.subprocess.DEVNULL,
+                    stderr=asyncio.subprocess.DEVNULL,
+                    start_new_session=True
+                )
+        return 0, "", ""
+
+    async def kill(self, service_name: str):
+        proc = self._procs.pop(service_name, None)
+        if proc is None or proc.returncode is not None:
+            return
+        proc.send_signal(signal.SIGTERM)
+        try:
+            await asyncio.wait_for(proc.wait(), 10)
+        except asyncio.TimeoutError:
+            proc.kill()
+            await proc.wait()
+
+
+# 可插拔的服务控制后端，以 --services 选择
+SERVICE_CONTROLS = {
+    "systemctl": SystemctlControl,
+    "fake": FakeControl
+}
+
+def get_service_control(kind: str) -> ServiceControl:
+    """创建服务控制后端"""
+    if kind not in SERVICE_CONTROLS:
+        raise ValueError(f"invalid service control {kind}")
+    return SERVICE_CONTROLS[kind]()
+
+
 if __name__ == "__main__":
     if len(sys.argv) == 3:
         json_path = sys.argv[2]
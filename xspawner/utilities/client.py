@@ -6,7 +6,9 @@ import json
 import io
 import os
 import mimetypes
-from .misc import get_file_type, make_multipart_request, parse_reply
+from .misc import get_file_type, make_multipart_request, make_json_request, parse_reply
+from .pool import fetch_sync
+from . import codec
 
 class Client:
     def __init__(self, addr):
@@ -29,10 +31,7 @@ class Client:
                 f.write(fdata)
 
     def postJson(self, path, jdata):
-        headers = {
-            "Content-Type": "application/json"
-        }
-        body = json.dumps(jdata) 
+        headers, body = make_json_request(self.addr + path, jdata)
         return self.postSync(path, headers, body)
 
 
@@ -52,10 +51,9 @@ class Client:
 
 
     def postSync(self, path, headers, body):
-        client = tornado.httpclient.HTTPClient()
         url = self.addr + path
         try:
-            res = client.fetch(url, method='POST', headers=headers, body=body)
+            res = fetch_sync(url, method='POST', headers=headers, body=body)
             if res.code == 200:
                 return parse_reply(res)
         except Exception as e:
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2025 Song Feng.
+
+# JSON codec for request/response bodies, reports and messages
+#   orjson is used when it is installed, otherwise the standard json
+#   dumps returns str, dumpb returns bytes, loads accepts str or bytes
+# MessagePack codec for peer to peer messages if msgpack is installed
+#   packb returns bytes, unpackb accepts bytes, both are None without msgpack
+import json
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+try:
+    import msgpack
+except ImportError:
+    msgpack = None
+
+
+# namedtuple such as Config is encoded by _asdict(), State and alike by __json__()
+def default(obj):
+    if hasattr(obj, "_asdict"):
+        return obj._asdict()
+    if hasattr(obj, "__json__"):
+        return obj.__json__()
+    raise TypeError(f"{type(obj)} is not JSON serializable")
+
+
+# the standard json and msgpack encode namedtuple as array before default is asked,
+# so namedtuples are turned into dicts beforehand to match orjson
+def asdicts(obj):
+    if isinstance(obj, tuple):
+        if hasattr(obj, "_asdict"):
+            return {k: asdicts(v) for k, v in obj._asdict().items()}
+        return [asdicts(v) for v in obj]
+    if isinstance(obj, list):
+        return [asdicts(v) for v in obj]
+    if isinstance(obj, dict):
+        return {k: asdicts(v) for k, v in obj.items()}
+    return obj
+
+
+if orjson:
+    BACKEND = "orjson"
+
+    def dumpb(obj):
+        return orjson.dumps(obj, default=default, option=orjson.OPT_NON_STR_KEYS)
+
+    def dumps(obj):
+        return dumpb(obj).decode()
+
+    def loads(data):
+        return orjson.loads(data)
+
+else:
+    BACKEND = "json"
+    _encoder = json.JSONEncoder(default=default, ensure_ascii=False, separators=(',', ':'))
+
+    def dumps(obj):
+        return _encoder.encode(asdicts(obj))
+
+    def dumpb(obj):
+        return dumps(obj).encode()
+
+    def loads(data):
+        return json.loads(data)
+
+
+if msgpack:
+    def packb(obj):
+        return msgpack.packb(asdicts(obj), default=default, use_bin_type=True)
+
+    # int keys are encoded by the JSON backends as well, so they are not rejected here
+    def unpackb(data):
+        return msgpack.unpackb(data, raw=False, strict_map_key=False)
+
+else:
+    packb = None
+    unpackb = None
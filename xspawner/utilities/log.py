@@ -1,10 +1,20 @@
 import json
-import http.client
 import logging
-from logging.handlers import RotatingFileHandler, HTTPHandler
+from logging.handlers import RotatingFileHandler, HTTPHandler, QueueHandler, QueueListener
 from urllib.parse import urlparse
+import collections
+import collections.abc
+import threading
+import atexit
+import queue
 import os
 
+from .pool import fetch_sync
+from ..constants import (
+    JSON_MIME_TYPE, NDJSON_MIME_TYPE, POOL_TIMEOUT, LOG_BATCH_FORMAT, LOG_BATCH_SIZE,
+    LOG_BUFFER_SIZE, LOG_FLUSH_INTERVAL, LOG_RETRY_BASE, LOG_RETRY_MAX
+)
+
 
 LEVELS = {
     'debug': logging.DEBUG,
@@ -14,40 +24,174 @@ LEVELS = {
     'critical': logging.CRITICAL
 }
 
+# 批量日志的格式及其 Content-Type
+BATCH_FORMATS = {
+    'ndjson': NDJSON_MIME_TYPE,
+    'json': JSON_MIME_TYPE
+}
+
+class JsonFormatter(logging.Formatter):
+    """把日志格式化为一行 JSON 对象，字段与 Logmon 的 /queue 接口一致"""
+
+    def format(self, record):
+        content = record.getMessage()
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            content += "\n" + record.exc_text
+        return json.dumps({
+            "timestamp": "%s.%03d" % (self.formatTime(record, self.datefmt), record.msecs),
+            "system": record.name,
+            "severity": record.levelname.lower(),
+            "content": content
+        }, ensure_ascii=False)
+
+
 class JsonHTTPHandler(HTTPHandler):
-    def __init__(self, recorder):
+    """
+    批量发送日志的 HTTP 处理器
+    日志先进入有界缓冲区，后台线程在攒够 batch_size 条或每隔 flush_interval 秒时
+    把它们以 NDJSON 或 JSON 数组一次 POST 出去，经连接池复用长连接
+    发送失败的一批按指数退避重试，期间缓冲区满时丢弃最旧的日志并计数
+    """
+
+    def __init__(self, recorder, batch_format=LOG_BATCH_FORMAT, batch_size=LOG_BATCH_SIZE,
+                 flush_interval=LOG_FLUSH_INTERVAL, capacity=LOG_BUFFER_SIZE):
         parsed = urlparse(recorder)
         secure = parsed.scheme.lower() == "https"
         host = parsed.netloc
         url = parsed.path if parsed.path else '/'
         method = "POST"
         super().__init__(host, url, method, secure)
-        self.headers = {'Content-Type': 'application/json'}
+        if batch_format not in BATCH_FORMATS:
+            raise ValueError(f"Invalid batch format {batch_format}")
+        self.headers = {'Content-Type': BATCH_FORMATS[batch_format]}
+        self.recorder = recorder
+        self.batch_format = batch_format
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.buffer = collections.deque(maxlen=capacity)
+        self.ready = threading.Condition()
+        self.closing = False
+        self.stats = {"buffered": 0, "sent": 0, "batches": 0, "retries": 0, "dropped": 0}
+        self.worker = threading.Thread(target=self.ship, name=f"log-{host}", daemon=True)
+        self.worker.start()
 
     def emit(self, record):
         try:
-            # 构造 JSON 数据
-            formatted_log = self.format(record)
-            payload = formatted_log.encode('utf-8')
-
-            # 根据 secure 参数选择 HTTPS 连接
-            conn_class = http.client.HTTPSConnection if self.secure else http.client.HTTPConnection
-            conn = conn_class(self.host)
-            conn.request(self.method, self.path, body=payload, headers=self.headers)
-            response = conn.getresponse()
-            response.read()
-            conn.close()
-        except Exception as e:
+            line = self.format(record)
+        except Exception:
             self.handleError(record)
+            return
+        with self.ready:
+            if len(self.buffer) == self.buffer.maxlen:
+                self.stats["dropped"] += 1
+            self.buffer.append(line)
+            self.stats["buffered"] += 1
+            if len(self.buffer) >= self.batch_size:
+                self.ready.notify()
+
+    def encode(self, lines: list) -> bytes:
+        if self.batch_format == 'ndjson':
+            return ("\n".join(lines) + "\n").encode('utf-8')
+        return ("[" + ",".join(lines) + "]").encode('utf-8')
+
+    def ship(self):
+        """后台线程：按数量或时间取出一批发送，失败的一批留待重试，关闭时发完剩余的日志"""
+        batch, retry = [], 0
+        while True:
+            with self.ready:
+                if batch:
+                    delay = min(LOG_RETRY_BASE * 2 ** (retry - 1), LOG_RETRY_MAX)
+                    self.ready.wait_for(lambda: self.closing, delay)
+                elif not self.closing and len(self.buffer) < self.batch_size:
+                    self.ready.wait(self.flush_interval)
+                if not batch:
+                    batch = [self.buffer.popleft() for _ in range(min(self.batch_size, len(self.buffer)))]
+                closing = self.closing
+            if batch:
+                try:
+                    # 复用连接池中的长连接
+                    fetch_sync(self.recorder, method=self.method, body=self.encode(batch), headers=self.headers)
+                except Exception:
+                    with self.ready:
+                        self.stats["retries"] += 1
+                        if closing:
+                            # 关闭时不再重试，剩余日志计为丢弃
+                            self.stats["dropped"] += len(batch) + len(self.buffer)
+                            self.buffer.clear()
+                            return
+                    retry = min(retry + 1, 16)
+                    continue
+                with self.ready:
+                    self.stats["sent"] += len(batch)
+                    self.stats["batches"] += 1
+                batch, retry = [], 0
+            if closing and not self.buffer:
+                return
+
+    def flush(self):
+        """唤醒后台线程立即发送缓冲区中的日志"""
+        with self.ready:
+            self.ready.notify()
+
+    def close(self):
+        """停止后台线程，在超时前尽量发完缓冲区中的日志"""
+        with self.ready:
+            self.closing = True
+            self.ready.notify()
+        self.worker.join(POOL_TIMEOUT)
+        super().close()
+
+    def getStats(self) -> dict:
+        with self.ready:
+            return dict(self.stats, pending=len(self.buffer))
+
+
+# 可能被调用方修改的参数类型
+CONTAINERS = (tuple, collections.abc.Mapping, collections.abc.MutableSequence, collections.abc.Set)
+
+
+class DropQueueHandler(QueueHandler):
+    """
+    非阻塞的队列处理器，队列满时丢弃日志并计数
+    消息格式化和写入都在 QueueListener 的后台线程中进行
+    """
+
+    def __init__(self, log_queue):
+        super().__init__(log_queue)
+        self.stats = {"enqueued": 0, "dropped": 0, "peak": 0}
+
+    def prepare(self, record):
+        # 推迟格式化，只把异常信息固化为文本，参数在写入时才格式化
+        # 含容器参数的消息立即格式化，调用方随后修改（包括嵌套内容）不影响日志，也不会在后台线程中出错
+        args = record.args.values() if isinstance(record.args, dict) else (record.args or ())
+        if isinstance(record.args, dict) or any(isinstance(arg, CONTAINERS) for arg in args):
+            record.msg = record.getMessage()
+            record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.stats["dropped"] += 1
+            return
+        self.stats["enqueued"] += 1
+        self.stats["peak"] = max(self.stats["peak"], self.queue.qsize())
 
 
 class Log(logging.Logger):
     """
     自定义日志记录器，继承自 logging.Logger
     支持将日志写入本地文件（RotatingFileHandler）或通过 HTTP 服务发送（AsyncJSONHttpHandler）
+    queue_size 大于 0 时日志经队列交给后台线程写入，调用方不阻塞
     """
 
-    def __init__(self, name: str, category: str, recorder: str, severity: str = "info"):
+    def __init__(self, name: str, category: str, recorder: str, severity: str = "info", queue_size: int = 0):
         """
         初始化 Log 实例
 
@@ -58,9 +202,13 @@ class Log(logging.Logger):
                 - file: 文件路径
                 - http: HTTP/HTTPS 服务 URL
             severity: 日志级别，支持 'debug', 'info', 'warning', 'error', 'critical'
+            queue_size: 日志队列长度，0 表示在调用线程中同步写入
         """
         # 调用父类初始化
         super().__init__(name)
+        self.queue_size = queue_size
+        self.listener = None
+        self.closed = False
 
         # 设置日志级别
         self.setLevel(LEVELS.get(severity, logging.DEBUG))
@@ -88,10 +236,11 @@ class Log(logging.Logger):
                 JsonHTTPHandler,
                 recorder,
                 severity,
-                '{"timestamp":"%(asctime)s.%(msecs)03d","system":"%(name)s","severity":"%(levelname)s","content":"%(message)s"}'
+                None,
+                formatter=JsonFormatter
             )
 
-    def _configure_handler(self, klass, recorder, severity, fmt, **misc):
+    def _configure_handler(self, klass, recorder, severity, fmt, formatter=logging.Formatter, **misc):
         try:
             self.handlers.clear()
             handler = klass(
@@ -99,7 +248,29 @@ class Log(logging.Logger):
                 **misc
             )
             handler.setLevel(LEVELS.get(severity, logging.DEBUG))
-            handler.setFormatter(logging.Formatter(fmt, datefmt='%Y-%m-%dT%H:%M:%S'))
+            handler.setFormatter(formatter(fmt, datefmt='%Y-%m-%dT%H:%M:%S'))
+            if self.queue_size > 0:
+                # 实际的处理器由后台线程驱动，进程退出时写完队列中剩余的日志
+                self.listener = QueueListener(queue.Queue(self.queue_size), handler, respect_handler_level=True)
+                self.listener.start()
+                atexit.register(self.close)
+                handler = DropQueueHandler(self.listener.queue)
             self.addHandler(handler)
         except Exception as e:
             raise RuntimeError(f"Failed to initialize handler: {e}") from e
+
+    def close(self):
+        """停止后台线程并写完队列中的日志"""
+        if self.listener and not self.closed:
+            self.closed = True
+            self.listener.stop()
+
+    def getStats(self) -> dict:
+        """队列模式下返回入队、丢弃、峰值和当前长度，http 类型另有批量发送的统计"""
+        stats = {}
+        if self.listener:
+            stats.update(self.handlers[0].stats, queued=self.listener.queue.qsize(), capacity=self.queue_size)
+        handler = self.listener.handlers[0] if self.listener else self.handlers[0]
+        if isinstance(handler, JsonHTTPHandler):
+            stats["http"] = handler.getStats()
+        return stats
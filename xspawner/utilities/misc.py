@@ -6,6 +6,7 @@ import requests
 from requests.exceptions import RequestException
 
 import queue
+import asyncio
 import time
 import datetime
 import json
@@ -28,7 +29,10 @@ import importlib
 import pkgutil
 import inspect
 import hashlib
+import itertools
 from functools import lru_cache
+from . import codec
+from ..constants import JSON_MIME_TYPE, MSGPACK_MIME_TYPE, CHUNK_SIZE
 
 
 # better than getCurTimeStr
@@ -416,11 +420,32 @@ def make_multipart_request(args, docs):
     }
     return headers, body
 
+# peers (netloc of url) which have replied in MessagePack
+MSGPACK_PEERS = set()
+
+# return headers and body posting jdata to url
+#   MessagePack is sent to the peers known to speak it, and always accepted if available
+def make_json_request(url, jdata):
+    if codec.packb and parse_net_url(url) in MSGPACK_PEERS:
+        headers = {
+            "Content-Type": MSGPACK_MIME_TYPE,
+            "Accept": "{}, {}".format(MSGPACK_MIME_TYPE, JSON_MIME_TYPE)
+        }
+        return headers, codec.packb(jdata)
+    headers = {
+        "Content-Type": JSON_MIME_TYPE
+    }
+    if codec.packb:
+        headers["Accept"] = "{}, {}".format(MSGPACK_MIME_TYPE, JSON_MIME_TYPE)
+    return headers, codec.dumpb(jdata)
+
 def parse_reply(res):
     ct = res.headers.get_list('Content-Type')[0]
-    if ct == "application/json":            
-        rdata = res.body.decode()
-        return json.loads(rdata)
+    if ct == JSON_MIME_TYPE:
+        return codec.loads(res.body)
+    elif ct == MSGPACK_MIME_TYPE and codec.unpackb:
+        MSGPACK_PEERS.add(parse_net_url(res.effective_url))
+        return codec.unpackb(res.body)
     elif ct == "application/octet-stream":
         cd = res.headers.get_list('Content-Disposition')[0]
         # cd is like 'attachment; filename=...'
@@ -642,9 +667,11 @@ def filter_logs(log_file, hours):
             f.writelines(filtered_lines)
 
 
+# output_path can be file path or writable file object (even unseekable)
 def zip_folder(folder_path, output_path, excluded_subdirs):
-    os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
-    
+    if isinstance(output_path, str):
+        os.makedirs(os.path.dirname(os.path.abspath(output_path)), exist_ok=True)
+
     with zipfile.ZipFile(output_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
         for root, dirs, files in os.walk(folder_path):
             dirs[:] = [d for d in dirs if d not in excluded_subdirs]
@@ -656,22 +683,43 @@ def zip_folder(folder_path, output_path, excluded_subdirs):
 
 
 
+# SSL contexts are built once per kind and files, like {(kind, *paths): (mtimes, context)}
+#   a file changed on disk builds a new context at the next call
+SSL_CONTEXTS = {}
+
+def get_cached_ssl_context(kind, build, *paths):
+    mtimes = tuple(os.path.getmtime(path) if path and os.path.isfile(path) else None for path in paths)
+    cached = SSL_CONTEXTS.get((kind,) + paths)
+    if cached and cached[0] == mtimes:
+        return cached[1]
+    context = build()
+    SSL_CONTEXTS[(kind,) + paths] = (mtimes, context)
+    return context
+
+def build_ssl_context_simple(cert_file):
+    context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
+    context.verify_mode = ssl.VERIFY_DEFAULT
+    context.load_cert_chain(certfile=cert_file)
+    return context
+
+
 # the result is ssl.SSLContext object
 # it can be applied for ssl_options, a parameter  of tornado's client.fetch
 # cert_file can be file path or file text containing certificate and private key
 def getSSLContextSimple(cert_file):
     if os.path.isfile(cert_file):
-        context = ssl.SSLContext(ssl.PROTOCOL_SSLv23)
-        context.verify_mode = ssl.VERIFY_DEFAULT
-        context.load_cert_chain(certfile=cert_file)
-        return context
+        return get_cached_ssl_context("simple", lambda: build_ssl_context_simple(cert_file), cert_file)
     else:
-        filepath = tempfile.mktemp()
-        with open(filepath, 'wb') as fp:
-            fp.write(cert_file.encode())
-        context = getSSLContextSimple(filepath)
-        os.unlink(filepath)
-        return context
+        # the cert text is loaded from a temporary file which is not cached itself
+        def build():
+            fd, filepath = tempfile.mkstemp()
+            try:
+                with os.fdopen(fd, 'wb') as fp:
+                    fp.write(cert_file.encode())
+                return build_ssl_context_simple(filepath)
+            finally:
+                os.unlink(filepath)
+        return get_cached_ssl_context("simple", build, sha256_encrypt(cert_file))
 
 
 def getSSLOptions(certfile, keyfile, ca_certs=None):
@@ -687,15 +735,28 @@ def getSSLOptions(certfile, keyfile, ca_certs=None):
 
 def getSSLContext(certfile, keyfile, ca_certs=None):
     if os.path.isfile(certfile) and os.path.isfile(keyfile):
-        ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
-        ssl_ctx.load_cert_chain(certfile=certfile, keyfile=keyfile)
-        # Optional: Require client certificates
-        if ca_certs and os.path.isfile(ca_certs):
-            ssl_ctx.verify_mode = ssl.CERT_REQUIRED
-            ssl_ctx.load_verify_locations(ca_certs)  # CA to verify client certs
-        else:
-            ssl_ctx.verify_mode = ssl.CERT_NONE
+        def build():
+            ssl_ctx = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+            ssl_ctx.load_cert_chain(certfile=certfile, keyfile=keyfile)
+            # Optional: Require client certificates
+            if ca_certs and os.path.isfile(ca_certs):
+                ssl_ctx.verify_mode = ssl.CERT_REQUIRED
+                ssl_ctx.load_verify_locations(ca_certs)  # CA to verify client certs
+            else:
+                ssl_ctx.verify_mode = ssl.CERT_NONE
+            return ssl_ctx
+        return get_cached_ssl_context("server", build, certfile, keyfile, ca_certs)
+
+# client side context verifying servers against ca_certs (system CAs if None),
+#   certfile and keyfile are the client certificate for servers requiring one
+#   TLS sessions can only be resumed on the context which made them, so callers share this one
+def getClientSSLContext(ca_certs=None, certfile=None, keyfile=None):
+    def build():
+        ssl_ctx = ssl.create_default_context(ssl.Purpose.SERVER_AUTH, cafile=ca_certs)
+        if certfile:
+            ssl_ctx.load_cert_chain(certfile=certfile, keyfile=keyfile)
         return ssl_ctx
+    return get_cached_ssl_context("client", build, ca_certs, certfile, keyfile)
 
 
 def trim_code(code):
@@ -748,6 +809,65 @@ class JSONEncoderWDT(json.JSONEncoder):
             return json.JSONEncoder.default(self, obj)
 
 
+# file-like object for a worker thread writing chunks of CHUNK_SIZE to an asyncio.Queue of loop
+#   the thread is blocked while the queue is full, None is put as the end mark on close
+#   writing fails once aborted is set by the reader
+class ChunkWriter(io.RawIOBase):
+    def __init__(self, loop, queue):
+        super().__init__()
+        self._loop = loop
+        self._queue = queue
+        self._buf = bytearray()
+        self.aborted = False
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        if self.aborted:
+            raise BrokenPipeError("chunk reader is gone")
+        self._buf += b
+        if len(self._buf) >= CHUNK_SIZE:
+            self._put(bytes(self._buf))
+            self._buf.clear()
+        return len(b)
+
+    def close(self):
+        if not self.closed:
+            if self._buf and not self.aborted:
+                self._put(bytes(self._buf))
+            self._put(None)
+        super().close()
+
+    def _put(self, item):
+        asyncio.run_coroutine_threadsafe(self._queue.put(item), self._loop).result()
+
+
+# cumulative histogram of durations in seconds, buckets are the upper bounds
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = tuple(sorted(buckets))
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                break
+        else:
+            i = len(self.buckets)
+        self.counts[i] += 1
+        self.total += value
+
+    def __json__(self):
+        counts = itertools.accumulate(self.counts)
+        return {
+            "count": sum(self.counts),
+            "sum": round(self.total, 6),
+            "buckets": dict(zip([str(bound) for bound in self.buckets] + ["+Inf"], counts))
+        }
+
+
 class Singleton(type):
     _instance = {}
 
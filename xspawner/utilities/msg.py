@@ -9,35 +9,34 @@ from ssl import SSLContext
 from typing import Optional, Union
 import os.path
 from .misc import make_multipart_form, make_docs, parse_reply
+from .pool import fetch_sync, fetch_async
+from . import codec
 
 def js_to_dict(js):
-    # return json.loads(js) or
-    return tornado.escape.json_decode(js)
+    # return json.loads(js) or tornado.escape.json_decode(js)
+    return codec.loads(js)
 
 
 def dict_to_js(dt):
-    # return json.dumps(dt) or
-    return tornado.escape.json_encode(dt)
+    # return json.dumps(dt) or tornado.escape.json_encode(dt)
+    return codec.dumps(dt)
 
 
 # The functions such as syncReg and asyncReq are for peer to peer service
 # req_dict is 1-level dict composed of string key and string value
 # note: urllib.parse.urlencode() and request/response.body.decode() are opposite operations dict <=> urlstr
 def syncReq(url: str, method: str, data: str = None, **kwargs):
-    client = tornado.httpclient.HTTPClient()
     try:
-        res = client.fetch(url, method=method, body=data, **kwargs)
+        res = fetch_sync(url, method=method, body=data, **kwargs)
         return res.body.decode()
     except Exception as e:
         print('Error in msg.syncReq:', url, repr(e))
         return None
-    finally:
-        client.close()
 
 
 def postSyncReq(url: str, data: dict):
-    rstr = syncReq(url, 'POST', json.dumps(data))
-    return json.loads(rstr)
+    rstr = syncReq(url, 'POST', codec.dumpb(data))
+    return codec.loads(rstr)
 
 
 def postSyncFile(url: str, filepath: str, fileargs: dict={}):
@@ -51,7 +50,7 @@ def postSyncFile(url: str, filepath: str, fileargs: dict={}):
         "Content-Length": str(len(body))
     }
     rstr = syncReq(url, method='POST', headers=headers, data=body)
-    return json.loads(rstr)
+    return codec.loads(rstr)
 
 
 def syncTLSReq(url: str, method: str, data: str = None, cert_ctx: SSLContext = None):
@@ -61,10 +60,8 @@ def syncTLSReq(url: str, method: str, data: str = None, cert_ctx: SSLContext = N
 
 # asyncReq and postMSg are non-blocking and synchronous
 async def asyncReq(url: str, method: str, data: str = None, **kwargs):
-    async_client = tornado.httpclient.AsyncHTTPClient()
-    # async_client.configure("tornado.curl_httpclient.CurlAsyncHTTPClient")
     try:
-        res = await async_client.fetch(url, method=method, body=data, **kwargs)
+        res = await fetch_async(url, method=method, body=data, **kwargs)
         return res.body.decode()
     except Exception as e:
         print('Error in msg.asyncReq:', url, repr(e))
@@ -79,8 +76,8 @@ async def asyncTLSReq(url: str,
 
 
 async def postAsyncReq(url: str, data: dict):
-    rstr = await asyncReq(url, 'POST', json.dumps(data))
-    return json.loads(rstr)
+    rstr = await asyncReq(url, 'POST', codec.dumpb(data))
+    return codec.loads(rstr)
 
 
 async def postAsyncFile(url: str, filepath: str, fileargs: dict={}):
@@ -94,13 +91,12 @@ async def postAsyncFile(url: str, filepath: str, fileargs: dict={}):
         "Content-Length": str(len(body))
     }
     rstr = await asyncReq(url, method='POST', headers=headers, data=body)
-    return json.loads(rstr)
+    return codec.loads(rstr)
 
 
 async def postAsync(url, headers, body):
-    client = tornado.httpclient.AsyncHTTPClient()
     try:
-        res = await client.fetch(url, method='POST', headers=headers, body=body)
+        res = await fetch_async(url, method='POST', headers=headers, body=body)
         if res.code == 200:
             return parse_reply(res)
     except Exception as e:
@@ -111,11 +107,12 @@ async def postAsync(url, headers, body):
 def parse_sse_event(data: str) -> dict:
     """
     parse SSE event
-    format: event:message\ndata: <JSON>\n\n
+    format: event:message\ndata: <JSON>\nid: <id>\n\n
     """
     result = {
         'event': None,
-        'data': None
+        'data': None,
+        'id': None
     }
 
     lines = data.strip().split('\n')
@@ -126,8 +123,10 @@ def parse_sse_event(data: str) -> dict:
         elif line.startswith('data:'):
             json_str = line[5:].strip()
             try:
-                result['data'] = json.loads(json_str)
-            except json.JSONDecodeError:
+                result['data'] = codec.loads(json_str)
+            except ValueError:
                 result['data'] = json_str
+        elif line.startswith('id:'):
+            result['id'] = line[3:].strip()
 
     return result
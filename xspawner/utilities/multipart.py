@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2025 Song Feng.
+
+import re
+import tempfile
+
+# file parts larger than SPOOL_SIZE are spooled to a temporary file on disk
+SPOOL_SIZE = 1024 * 1024
+
+DISPOSITION_PARAM = re.compile(r'(\w+)="([^"]*)"')
+
+
+# Incremental parser of a multipart/form-data body fed chunk by chunk
+#   the file part is spooled and never held as a whole bytes object,
+#   the other parts are form fields kept in fargs
+# result() returns (fdata, fname, fargs) like ApiHandler II (upload) params,
+#   fdata is a file-like object at offset 0
+class MultipartStreamParser:
+    def __init__(self, boundary: bytes):
+        # every delimiter is preceded by CRLF, the first one is given a virtual CRLF
+        self._delimiter = b"\r\n--" + boundary
+        self._buffer = b"\r\n"
+        self._state = "preamble"
+        self._sink = None
+        self._name = None
+        self.fdata = None
+        self.fname = ""
+        self.fargs = {}
+
+    def feed(self, chunk: bytes):
+        self._buffer += chunk
+        while self._step():
+            pass
+
+    def close(self):
+        self.feed(b"")
+        if self._state != "end":
+            raise ValueError("multipart body is incomplete")
+
+    def result(self):
+        if self.fdata is None:
+            self.fdata = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        self.fdata.seek(0)
+        return self.fdata, self.fname, self.fargs
+
+    # consume the buffer as far as possible, return True if the state moved on
+    def _step(self):
+        if self._state == "preamble":
+            pos = self._buffer.find(self._delimiter)
+            if pos < 0:
+                self._buffer = self._buffer[-len(self._delimiter):]
+                return False
+            self._buffer = self._buffer[pos + len(self._delimiter):]
+            self._state = "delimiter"
+            return True
+        elif self._state == "delimiter":
+            if len(self._buffer) < 2:
+                return False
+            if self._buffer[:2] == b"--":
+                self._state = "end"
+                self._buffer = b""
+                return False
+            self._buffer = self._buffer[2:]
+            self._state = "headers"
+            return True
+        elif self._state == "headers":
+            pos = self._buffer.find(b"\r\n\r\n")
+            if pos < 0:
+                return False
+            # a filename in another charset is kept with replacement characters
+            self._open_part(self._buffer[:pos].decode("utf-8", errors="replace"))
+            self._buffer = self._buffer[pos + 4:]
+            self._state = "body"
+            return True
+        elif self._state == "body":
+            pos = self._buffer.find(self._delimiter)
+            if pos < 0:
+                # keep a tail which may be the beginning of the delimiter
+                keep = len(self._delimiter) - 1
+                if len(self._buffer) > keep:
+                    self._sink.write(self._buffer[:-keep])
+                    self._buffer = self._buffer[-keep:]
+                return False
+            self._sink.write(self._buffer[:pos])
+            self._close_part()
+            self._buffer = self._buffer[pos + len(self._delimiter):]
+            self._state = "delimiter"
+            return True
+        return False
+
+    def _open_part(self, head):
+        params = {}
+        for line in head.split("\r\n"):
+            key, _, value = line.partition(":")
+            if key.strip().lower() == "content-disposition":
+                params = dict(DISPOSITION_PARAM.findall(value))
+        self._name = params.get("name", "")
+        if "filename" in params or (self._name == "file" and self.fdata is None):
+            # the first file part is the upload, the key "file" is fixed like make_multipart_request
+            self.fname = params.get("filename", "")
+            self.fdata = self._sink = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+        else:
+            self._sink = tempfile.SpooledTemporaryFile(max_size=SPOOL_SIZE)
+
+    def _close_part(self):
+        if self._sink is not self.fdata:
+            self._sink.seek(0)
+            self.fargs[self._name] = self._sink.read().decode()
+            self._sink.close()
+        self._sink = None
@@ -0,0 +1,262 @@
+# -*- coding: utf-8 -*-
+# Copyright © 2025 Song Feng.
+
+import tornado.httpclient
+import tornado.simple_httpclient
+import tornado.httputil
+import tornado.locks
+import http.client
+import threading
+import urllib.parse
+import time
+import sys
+import io
+import ssl
+from functools import lru_cache
+from ..constants import POOL_MAX_PER_HOST, POOL_TIMEOUT
+from .misc import getClientSSLContext
+
+
+REDIRECT_CODES = (301, 302, 303, 307, 308)
+# headers describing a body, dropped when a redirect turns the request into a GET
+BODY_HEADERS = ("content-length", "content-type", "content-encoding", "transfer-encoding")
+
+
+# the context of validate_cert=False requests, it is shared so that their TLS sessions resume
+@lru_cache(maxsize=None)
+def get_unverified_ssl_context():
+    ssl_ctx = ssl.create_default_context()
+    ssl_ctx.check_hostname = False
+    ssl_ctx.verify_mode = ssl.CERT_NONE
+    return ssl_ctx
+
+
+# HTTPSConnection offering the TLS session of an earlier connection, so the handshake is abbreviated
+class ResumableHTTPSConnection(http.client.HTTPSConnection):
+    session = None
+
+    def connect(self):
+        http.client.HTTPConnection.connect(self)
+        self.sock = self._context.wrap_socket(
+            self.sock, server_hostname=self._tunnel_host or self.host, session=self.session
+        )
+
+
+# ConnectionPool keeps keep-alive connections per (scheme, netloc, ssl context) for blocking callers
+#   a host has at most max_per_host idle connections, extra ones are closed after use
+#   a reused connection the server has dropped is retried once on a new connection
+#   a new https connection resumes the latest TLS session of its key unless resume is False,
+#   handshakes counts the full ones and resumed the abbreviated ones
+class ConnectionPool:
+    def __init__(self, max_per_host=POOL_MAX_PER_HOST, timeout=POOL_TIMEOUT, resume=True):
+        self.max_per_host = max_per_host
+        self.timeout = timeout
+        self.resume = resume
+        self._idle = {}
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self.stats = {"requests": 0, "connections": 0, "reused": 0, "retried": 0, "handshakes": 0, "resumed": 0}
+
+    def acquire(self, key, timeout):
+        with self._lock:
+            idle = self._idle.get(key)
+            if idle:
+                self.stats["reused"] += 1
+                return idle.pop(), True
+            self.stats["connections"] += 1
+        scheme, netloc, ssl_context = key
+        if scheme == "https":
+            # sessions only resume on the context which made them, so the default one is shared
+            conn = ResumableHTTPSConnection(netloc, timeout=timeout, context=ssl_context or getClientSSLContext())
+            if self.resume:
+                conn.session = self._sessions.get(key)
+        else:
+            conn = http.client.HTTPConnection(netloc, timeout=timeout)
+        return conn, False
+
+    # TLS 1.3 tickets come after the handshake, so the session is taken once a response was read
+    def keepSession(self, key, conn, reused):
+        sock = getattr(conn, "sock", None)
+        if not isinstance(sock, ssl.SSLSocket):
+            return
+        with self._lock:
+            if not reused:
+                self.stats["resumed" if sock.session_reused else "handshakes"] += 1
+            if self.resume and sock.session is not None:
+                self._sessions[key] = sock.session
+
+    def release(self, key, conn):
+        with self._lock:
+            idle = self._idle.setdefault(key, [])
+            if len(idle) < self.max_per_host:
+                idle.append(conn)
+                return
+        conn.close()
+
+    # same arguments and result as tornado.httpclient.HTTPClient.fetch for the keywords below,
+    #   other keywords of tornado.httpclient.HTTPRequest raise TypeError instead of being ignored
+    #   redirects are followed like tornado, 301/302 of a POST and 303 are turned into a GET without body
+    def fetch(self, url, method="GET", body=None, headers=None, ssl_options=None, request_timeout=None,
+              connect_timeout=None, follow_redirects=True, max_redirects=5, validate_cert=True,
+              raise_error=True, **kwargs):
+        if kwargs:
+            raise TypeError("ConnectionPool.fetch does not support {}".format(", ".join(sorted(kwargs))))
+        parts = urllib.parse.urlsplit(url)
+        path = parts.path or "/"
+        if parts.query:
+            path += "?" + parts.query
+        if isinstance(body, str):
+            body = body.encode()
+        context = ssl_options
+        if context is None and not validate_cert and parts.scheme == "https":
+            context = get_unverified_ssl_context()
+        key = (parts.scheme, parts.netloc, context)
+        timeout = request_timeout or self.timeout
+        with self._lock:
+            self.stats["requests"] += 1
+        while True:
+            conn, reused = self.acquire(key, timeout)
+            try:
+                if conn.sock is None:
+                    conn.timeout = connect_timeout or timeout
+                    conn.connect()
+                conn.sock.settimeout(timeout)
+                conn.request(method, path, body=body, headers=headers or {})
+                res = conn.getresponse()
+                data = res.read()
+            except (http.client.RemoteDisconnected, ConnectionResetError, BrokenPipeError):
+                conn.close()
+                if not reused:
+                    raise
+                with self._lock:
+                    self.stats["retried"] += 1
+                continue
+            except Exception:
+                conn.close()
+                raise
+            self.keepSession(key, conn, reused)
+            if res.will_close:
+                conn.close()
+            else:
+                self.release(key, conn)
+            break
+        location = res.getheader("Location")
+        if follow_redirects and max_redirects > 0 and res.status in REDIRECT_CODES and location:
+            if (res.status in (301, 302) and method == "POST") or (res.status == 303 and method != "HEAD"):
+                method, body = "GET", None
+                headers = {k: v for k, v in (headers or {}).items() if k.lower() not in BODY_HEADERS}
+            return self.fetch(
+                urllib.parse.urljoin(url, location), method=method, body=body, headers=headers,
+                ssl_options=ssl_options, request_timeout=request_timeout, connect_timeout=connect_timeout,
+                follow_redirects=follow_redirects, max_redirects=max_redirects - 1,
+                validate_cert=validate_cert, raise_error=raise_error
+            )
+        response = tornado.httpclient.HTTPResponse(
+            tornado.httpclient.HTTPRequest(url, method=method),
+            res.status,
+            reason=res.reason,
+            headers=tornado.httputil.HTTPHeaders(res.getheaders()),
+            buffer=io.BytesIO(data),
+            effective_url=url
+        )
+        if raise_error:
+            response.rethrow()
+        return response
+
+    def getStats(self):
+        with self._lock:
+            return dict(self.stats, idle=sum(len(idle) for idle in self._idle.values()), sessions=len(self._sessions))
+
+
+# AsyncConnectionPool runs non-blocking requests on the ioloop's shared AsyncHTTPClient
+#   curl keeps the connections alive between requests, a host gets at most max_per_host requests at once
+#   reuse is known from curl's connect time which is 0 on a kept connection
+#   curl caches TLS sessions itself but takes no ssl_options, requests with them go by the simple client
+#   which neither keeps connections alive nor resumes TLS sessions, only ConnectionPool resumes them
+class AsyncConnectionPool:
+    def __init__(self, max_per_host=POOL_MAX_PER_HOST):
+        self.max_per_host = max_per_host
+        self._sems = {}
+        self.stats = {"requests": 0, "connections": 0, "reused": 0}
+
+    # same arguments and result as tornado.httpclient.AsyncHTTPClient.fetch
+    async def fetch(self, url, **kwargs):
+        netloc = urllib.parse.urlsplit(url).netloc
+        if netloc not in self._sems:
+            self._sems[netloc] = tornado.locks.Semaphore(self.max_per_host)
+        self.stats["requests"] += 1
+        response = None
+        try:
+            async with self._sems[netloc]:
+                if kwargs.get("ssl_options") is not None:
+                    client = tornado.simple_httpclient.SimpleAsyncHTTPClient()
+                else:
+                    client = tornado.httpclient.AsyncHTTPClient()
+                response = await client.fetch(url, **kwargs)
+        except tornado.httpclient.HTTPClientError as e:
+            response = e.response
+            raise
+        finally:
+            self.count(response)
+        return response
+
+    def count(self, response):
+        if response is None or "connect" not in response.time_info:
+            return
+        if response.time_info["connect"] == 0:
+            self.stats["reused"] += 1
+        else:
+            self.stats["connections"] += 1
+
+    def getStats(self):
+        return dict(self.stats, hosts=len(self._sems))
+
+
+# pools shared by every outbound call of the process
+SYNC_POOL = ConnectionPool()
+ASYNC_POOL = AsyncConnectionPool()
+
+def fetch_sync(url, **kwargs):
+    return SYNC_POOL.fetch(url, **kwargs)
+
+async def fetch_async(url, **kwargs):
+    return await ASYNC_POOL.fetch(url, **kwargs)
+
+def get_pool_stats():
+    return {
+        "sync": SYNC_POOL.getStats(),
+        "async": ASYNC_POOL.getStats()
+    }
+
+
+# compares TLS handshakes and latency of a https url, the server certificate is not verified
+#   python -m xspawner.utilities.pool https://localhost:8888/ping [requests]
+#   fresh: a new connection with a full handshake per request
+#   resumed: a new connection per request resuming the previous TLS session
+#   pooled: keep-alive connections with resumed sessions
+def benchmark(url, count=100):
+    ssl_ctx = get_unverified_ssl_context()
+    results = {}
+    for name, pool in (
+        ("fresh", ConnectionPool(max_per_host=0, resume=False)),
+        ("resumed", ConnectionPool(max_per_host=0)),
+        ("pooled", ConnectionPool())
+    ):
+        start = time.perf_counter()
+        for _ in range(count):
+            pool.fetch(url, ssl_options=ssl_ctx)
+        stats = pool.getStats()
+        results[name] = {
+            "handshakes": stats["handshakes"],
+            "resumed": stats["resumed"],
+            "connections": stats["connections"],
+            "avg_ms": round((time.perf_counter() - start) * 1000 / count, 3)
+        }
+    return results
+
+
+if __name__ == "__main__":
+    if len(sys.argv) < 2:
+        sys.exit("usage: python -m xspawner.utilities.pool <https url> [requests]")
+    for name, result in benchmark(sys.argv[1], int(sys.argv[2]) if len(sys.argv) > 2 else 100).items():
+        print("%-8s %s" % (name, result))
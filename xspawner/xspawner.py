@@ -6,21 +6,28 @@ import tornado.iostream
 import tornado.gen
 import tornado.queues
 import tornado.concurrent
+import concurrent.futures
 import tornado.web
 import tornado.locks
 import tornado.httpserver
 import tornado.httpclient
+import tornado.simple_httpclient
 import tornado.httputil
 import tornado.tcpclient
+import tornado.netutil
+import tornado.process
+import tornado.util
 import pywebio.platform.tornado
 
 import os
+import asyncio
 import json
 import psutil
 import importlib
 import inspect
 import traceback
 import datetime
+import time
 import types
 import functools
 import itertools
@@ -29,20 +36,184 @@ import base64
 import ssl
 from urllib.parse import urlparse
 from typing import List
-from collections import namedtuple, UserDict
+from collections import namedtuple, deque, UserDict
+from multiprocessing.managers import BaseManager, DictProxy, ListProxy
 
 from .utilities.log import * # NOQA
 from .utilities.client import * # NOQA
 from .utilities.msg import * # NOQA
 from .utilities.misc import * # NOQA
+from .utilities import codec
+from .utilities.multipart import MultipartStreamParser
+from .utilities.pool import fetch_async, get_pool_stats
 from .constants import * # NOQA
 
 
-Config = namedtuple('Config', ['name', 'plugin', 'host', 'port', 'access', 'ancestry', 'reportup', 'log', 'severity', 'ssl', 'certfile', 'keyfile'])
+Config = namedtuple(
+    'Config',
+    ['name', 'plugin', 'host', 'port', 'access', 'ancestry', 'reportup', 'log', 'severity', 'ssl', 'certfile', 'keyfile', 'concurrency', 'queue', 'workers', 'threads', 'services', 'logqueue', 'recorder'],
+    defaults=(REQ_CONCURRENCY, REQ_QUEUE_SIZE, HTTP_WORKERS, SYNC_THREADS, SERVICE_BACKEND, LOG_QUEUE_SIZE, "")
+)
+
+
+# Route is the binding plan compiled once when an ApiHandler route is registered
+#   arity is fun.__code__.co_argcount = 1(self) + N({}|args|fdata, fname, farg)
+#   decode turns (headers, body) into the params after headers
+#   encode turns a non-file result into the response text
+Route = namedtuple(
+    'Route',
+    ['path', 'fun', 'name', 'arity', 'coro', 'decode', 'encode', 'content_type', 'serial', 'limit', 'reentrant', 'timeout', 'lane', 'offload', 'stream', 'primary'],
+    defaults=(False,)
+)
+
+# Flow is the stream plan compiled once when a FlowHandler route is registered
+#   push flows send events as soon as fun produces them instead of polling fun every interval
+Flow = namedtuple(
+    'Flow',
+    ['path', 'fun', 'varnames', 'broadcast', 'interval', 'backlog', 'push', 'coalesce', 'replay', 'snapshot', 'primary'],
+    defaults=(False,)
+)
+
+
+async def call_cbf(fun, *args, **kwargs):
+    if inspect.iscoroutinefunction(fun):
+        res = await fun(*args, **kwargs)
+    else:
+        res = fun(*args, **kwargs)
+    return res
+
+# one server-sent event as bytes
+def encode_event(evt):
+    return "".join("{}: {}\n".format(k, evt[k]) for k in evt).encode() + b"\n"
+
+# evts of a flow as encoded chunks until fun returns or yields False
+#   an async generator fun is iterated, a push coroutine fun is awaited back to back,
+#   any other fun is polled every interval
+async def iter_events(flow, server, headers, args, interval, encode=encode_event):
+    if inspect.isasyncgenfunction(flow.fun):
+        evts = flow.fun(server, headers, args)
+    elif flow.push:
+        async def await_events():
+            while True:
+                yield await flow.fun(server, headers, args)
+        evts = await_events()
+    else:
+        async def poll_events():
+            while True:
+                yield await call_cbf(flow.fun, server, headers, args)
+                await tornado.gen.sleep(interval)
+        evts = poll_events()
+    chunks = coalesce_events(evts, flow.coalesce, encode) if flow.coalesce else encode_events(evts, encode)
+    try:
+        async for chunk in chunks:
+            yield chunk
+    finally:
+        await chunks.aclose()
+        await evts.aclose()
+
+async def encode_events(evts, encode):
+    async for evt in evts:
+        if evt:
+            yield encode(evt)
+        elif evt is False:
+            return
+
+# evts produced within window after the first one go out as one chunk
+async def coalesce_events(evts, window, encode):
+    queue = tornado.queues.Queue()
+    async def pump():
+        try:
+            async for evt in evts:
+                if evt or evt is False:
+                    await queue.put(evt)
+                if evt is False:
+                    return
+        finally:
+            queue.put_nowait(False)
+    task = asyncio.ensure_future(pump())
+    try:
+        evt = await queue.get()
+        while evt is not False:
+            chunks = []
+            deadline = tornado.ioloop.IOLoop.current().time() + window
+            while evt is not False:
+                chunks.append(encode(evt))
+                try:
+                    evt = await queue.get(timeout=deadline)
+                except tornado.util.TimeoutError:
+                    evt = None
+                    break
+            yield b"".join(chunks)
+            if evt is None:
+                evt = await queue.get()
+    finally:
+        task.cancel()
+        await asyncio.gather(task, return_exceptions=True)
+
+
+def parse_multipart_boundary(ct):
+    assert isinstance(ct, str)
+    [ct1, ct2] = ct.split("; ")
+    [ct2a, ct2b] = ct2.split("=")
+    return ct2b
+
+
+# for UiHandler
+def decode_none(headers, body):
+    return ()
+
+
+# for ApiHandler I (normal) or FlowHandler
+def decode_json(headers, body):
+    # transport MessagePack if the peer posts it
+    if codec.unpackb and headers.get("Content-Type") == MSGPACK_MIME_TYPE:
+        return (codec.unpackb(body),)
+    # transport NDJSON as a list of its lines' objects
+    if headers.get("Content-Type") == NDJSON_MIME_TYPE:
+        return ([codec.loads(line) for line in body.splitlines() if line.strip()],)
+    # transport JSON
+    return (codec.loads(body),)
+
+
+# for ApiHandler II (upload)
+def decode_multipart(headers, body):
+    # transport File
+    ct = headers["Content-Type"] if "Content-Type" in headers else None
+    boundary = parse_multipart_boundary(ct)
+    args, docs = dict(), dict()
+    tornado.httputil.parse_multipart_form_data(boundary.encode(), body, args, docs)
+    # if filename is not empty string
+    #   args is dict like {"v1": [b"xyz"]}
+    #   docs is dict like {"file": [{"filename": "xFEs3r8w.html", "body": b"....", "content_type": "text/html"}]
+    # else
+    #   args is dict like {"file": [b"...."], "v1": [b"xyz"]}
+    #   docs is empty dict {}
+    if docs:
+        lv = list(docs.values())
+        fdata = lv[0][0]["body"]
+        fname = lv[0][0]["filename"]
+    else:
+        fdata = args.pop("file")[0]
+        fname = ""
+    fargs = {k: args[k][0].decode() for k in args}
+    return (fdata, fname, fargs)
+
+
+# for ApiHandler II (upload) streamed by UploadHandler
+#   body is (fdata, fname, fargs) parsed while receiving, fdata is file-like
+def decode_stream(headers, body):
+    return body
+
+
+DECODERS = {1: decode_none, 3: decode_json, 5: decode_multipart}
+
+
+def encode_json(res):
+    return res if isinstance(res, str) else codec.dumpb(res)
 
 
 INTERNAL_HANDLERS = ["PingPongHandler", "HomePageHandler", "ResourceHandler"]
-CUSTOMED_HANDLERS = ["ApiHandler", "UiHandler", "FlowHandler"]
+CUSTOMED_HANDLERS = ["ApiHandler", "UploadHandler", "UiHandler", "FlowHandler"]
 
 class PingPongHandler(tornado.web.RequestHandler):
     SUPPORTED_METHODS = ("GET",)
@@ -67,7 +238,7 @@ class ResourceHandler(tornado.web.StaticFileHandler):
 
 class ApiHandler(tornado.web.RequestHandler):
     SUPPORTED_METHODS = ("POST", "GET", "OPTIONS")
-    # path_map is path to handlers like dict {<post path> : <handle function>}
+    # path_map is path to routes like dict {<post path> : <Route>}
     #   url path begins with '/'
     path_map = {}
 
@@ -85,31 +256,17 @@ class ApiHandler(tornado.web.RequestHandler):
         from xspawner import XSpawner # NOQA
         gServer = XSpawner.getServer()
         assert gServer
-        q = gServer._req_queue
-        future = tornado.concurrent.Future()
-        condition = tornado.locks.Condition()
         path = self.request.path
+        if path in self.path_map and self.path_map[path].primary and gServer.getPrimaryAddr():
+            await self.forward(gServer.getPrimaryAddr())
+            return
         headers = self.request.headers
-        body = self.request.body
+        body = self.getBody()
         if path in self.path_map:
-            elem = (future, condition, path, headers, body)
-            await q.put(elem)
-            cond_res = await condition.wait(timeout=datetime.timedelta(seconds=5))
-            if cond_res and future._state == 'FINISHED':
-                if isinstance(future.result(), tuple):
-                    # download file
-                    fdata, fname = future.result()
-                    assert isinstance(fname, str) and \
-                           isinstance(fdata, bytes)
-                    self.set_header('Content-Type', 'application/octet-stream')
-                    self.set_header('Content-Disposition', 'attachment; filename=%s' % fname)
-                    self.write(fdata)
-                else:
-                    self.set_header('Content-Type', 'application/json')
-                    if isinstance(future.result(), str):
-                        self.write(future.result())
-                    else:
-                        self.write(json.dumps(future.result()))
+            route = self.path_map[path]
+            done, res = await self.call(gServer, route, headers, body)
+            if done:
+                await self.reply(route, res, JSON_MIME_TYPE)
             else:
                 self.write('false')
         else:
@@ -121,46 +278,238 @@ class ApiHandler(tornado.web.RequestHandler):
         from xspawner import XSpawner # NOQA
         gServer = XSpawner.getServer()
         assert gServer
-        q = gServer._req_queue
-        future = tornado.concurrent.Future()
-        condition = tornado.locks.Condition()
         path = self.request.path
+        if path in self.path_map and self.path_map[path].primary and gServer.getPrimaryAddr():
+            await self.forward(gServer.getPrimaryAddr())
+            return
         headers = dict(self.request.headers.get_all())
         reqargs = self.request.arguments
         args = {arg: reqargs[arg][0].decode() for arg in reqargs}
-        body = json.dumps(args).encode()
+        body = codec.dumpb(args)
+        headers["Content-Type"] = JSON_MIME_TYPE
         if path in self.path_map:
-            elem = (future, condition, path, headers, body)
-            await q.put(elem)
-            cond_res = await condition.wait(timeout=datetime.timedelta(seconds=5))
-            if cond_res and future._state == 'FINISHED':
-                if isinstance(future.result(), tuple):
-                    # download file
-                    fdata, fname = future.result()
-                    assert isinstance(fname, str) and \
-                           isinstance(fdata, bytes)
-                    self.set_header('Content-Type', 'application/octet-stream')
-                    self.set_header('Content-Disposition', 'attachment; filename=%s' % fname)
-                    self.write(fdata)
-                else:
-                    self.set_header('Content-Type', 'text/html; charset=utf-8')
-                    if isinstance(future.result(), str):
-                        self.write(future.result())
-                    else:
-                        self.write(json.dumps(future.result()))
+            route = self.path_map[path]
+            done, res = await self.call(gServer, route, headers, body)
+            if done:
+                await self.reply(route, res, 'text/html; charset=utf-8')
             else:
                 self.write('false')
         else:
             self.write('false')
         self.finish()
 
+    # return (done, result) of the route
+    #   reentrant routes are called inline, the others are queued for the server's workers
+    #   a route not done before its timeout is cancelled, or dropped if it is still queued
+    #   a route whose lane is full is rejected at once with 503
+    async def call(self, gServer, route, headers, body):
+        if route.reentrant:
+            try:
+                return True, await asyncio.wait_for(gServer.dispatch(route, headers, body), route.timeout)
+            except asyncio.TimeoutError:
+                gServer.wLog("%s is cancelled on timeout %s", route.path, route.timeout)
+                return False, None
+            except Exception as e:
+                gServer.eLog(traceback.format_exc())
+                gServer.eLog(repr(e))
+                return True, False
+        future = tornado.concurrent.Future()
+        deadline = gServer._ioloop.time() + route.timeout
+        elem = (future, route, headers, body, deadline)
+        if not gServer.enqueue(route, elem):
+            self.set_status(503)
+            self.set_header("Retry-After", str(REQ_RETRY_AFTER))
+            return False, None
+        try:
+            return True, await tornado.gen.with_timeout(deadline, future)
+        except tornado.util.TimeoutError:
+            # tell the worker to drop or cancel it
+            future.cancel()
+            return False, None
+
+    async def reply(self, route, res, ct):
+        if isinstance(res, tuple):
+            # download file
+            fdata, fname = res
+            assert isinstance(fname, str)
+            self.set_header('Content-Type', 'application/octet-stream')
+            self.set_header('Content-Disposition', 'attachment; filename=%s' % fname)
+            await self.download(fdata)
+        elif route.encode is encode_json and not isinstance(res, str) and self.acceptMsgpack():
+            self.set_header('Content-Type', MSGPACK_MIME_TYPE)
+            self.write(codec.packb(res))
+        else:
+            self.set_header('Content-Type', route.content_type or ct)
+            self.write(route.encode(res))
+
+    # fdata is bytes, file path, file-like object or async iterator of bytes
+    #   the others than bytes are sent chunk by chunk, with Content-Length if the size is known
+    async def download(self, fdata):
+        if isinstance(fdata, bytes):
+            self.write(fdata)
+            return
+        if isinstance(fdata, str):
+            fdata = open(fdata, 'rb')
+        if hasattr(fdata, "read"):
+            try:
+                try:
+                    self.set_header('Content-Length', os.fstat(fdata.fileno()).st_size - fdata.tell())
+                except (AttributeError, OSError):
+                    pass
+                while True:
+                    chunk = fdata.read(CHUNK_SIZE)
+                    if not chunk:
+                        break
+                    self.write(chunk)
+                    await self.flush()
+            finally:
+                fdata.close()
+        else:
+            # chunked transfer
+            async for chunk in fdata:
+                self.write(chunk)
+                await self.flush()
+
+    def getBody(self):
+        return self.request.body
+
+    # relay the request to the primary worker and its response back to the client
+    async def forward(self, addr):
+        route = self.path_map[self.request.path]
+        res = await fetch_async(
+            addr + self.request.uri,
+            method=self.request.method,
+            body=self.request.body if self.request.method == "POST" else None,
+            headers={k: v for k, v in self.request.headers.get_all() if k.lower() in FORWARD_HEADERS},
+            request_timeout=route.timeout + REQ_TIMEOUT,
+            raise_error=False
+        )
+        if res.code == 599:
+            raise tornado.web.HTTPError(502, "primary worker is unreachable: {}".format(res.error))
+        self.set_status(res.code, res.reason)
+        for k, v in res.headers.get_all():
+            if k.lower() in FORWARD_HEADERS + ("content-disposition", "retry-after"):
+                self.set_header(k, v)
+        self.write(res.body or b"")
+        self.finish()
+
+    # the peer asks for MessagePack and it is available
+    def acceptMsgpack(self):
+        return bool(codec.packb) and MSGPACK_MIME_TYPE in self.request.headers.get("Accept", "")
+
+    # serial: run exclusively against every other serial route (routes mutating children/state)
+    # limit: max concurrent executions of this route, 0 is unlimited
+    # reentrant: call the route directly in the handler instead of through the request queue
+    # encode: convert a non-file result to the response text
+    # content_type: response content type, None is by request method
+    # timeout: seconds to wait for the result before the route is cancelled
+    # lane: one of REQ_LANES, queued control routes are served before normal ones and normal before bulk
+    # offload: run a sync route in the server's thread pool instead of the ioloop thread
+    # stream: spool an upload route's multipart body while receiving it, fdata is file-like instead of bytes
+    # primary: serve it in the primary pre-forked worker only, the other workers forward it there,
+    #   for routes using what the workers do not share such as the children's units, flows and reports
     @classmethod
-    def route(cls, path):
+    def route(cls, path, serial=False, limit=0, reentrant=False, encode=encode_json, content_type=None, timeout=REQ_TIMEOUT, lane="normal", offload=False, stream=False, primary=False):
         def decorator(f):
-            cls.path_map[path] = f
+            arity = f.__code__.co_argcount
+            if arity not in DECODERS:
+                raise ValueError('{}: invalid argument count {}'.format(f.__code__.co_name, arity))
+            if lane not in REQ_LANES:
+                raise ValueError('{}: invalid lane {}'.format(f.__code__.co_name, lane))
+            if offload and inspect.iscoroutinefunction(f):
+                raise ValueError('{}: coroutine cannot be offloaded'.format(f.__code__.co_name))
+            if stream and arity != 5:
+                raise ValueError('{}: only upload can be streamed'.format(f.__code__.co_name))
+            if stream and primary:
+                raise ValueError('{}: a streamed upload cannot be forwarded'.format(f.__code__.co_name))
+            cls.path_map[path] = Route(
+                path=path,
+                fun=f,
+                name=f.__code__.co_name,
+                arity=arity,
+                coro=inspect.iscoroutinefunction(f),
+                decode=decode_stream if stream else DECODERS[arity],
+                encode=encode,
+                content_type=content_type,
+                serial=serial,
+                limit=limit,
+                reentrant=reentrant,
+                timeout=timeout,
+                lane=lane,
+                offload=offload,
+                stream=stream,
+                primary=primary
+            )
             return f
         return decorator
 
+    # route table for introspection
+    @classmethod
+    def routes(cls):
+        return [
+            {
+                "path": route.path,
+                "name": route.name,
+                "arity": route.arity,
+                "coro": route.coro,
+                "decode": route.decode.__name__,
+                "encode": route.encode.__name__,
+                "content_type": route.content_type,
+                "serial": route.serial,
+                "limit": route.limit,
+                "reentrant": route.reentrant,
+                "timeout": route.timeout,
+                "lane": route.lane,
+                "offload": route.offload,
+                "stream": route.stream,
+                "primary": route.primary
+            }
+            for route in cls.path_map.values()
+        ]
+
+
+# UploadHandler serves the routes of ApiHandler.route(stream=True)
+#   the multipart body is parsed chunk by chunk and the file part is spooled
+@tornado.web.stream_request_body
+class UploadHandler(ApiHandler):
+    SUPPORTED_METHODS = ("POST", "OPTIONS")
+
+    def prepare(self):
+        self._parser = None
+        self._error = None
+        if self.request.method == "POST":
+            self.request.connection.set_max_body_size(UPLOAD_MAX_SIZE)
+            try:
+                boundary = parse_multipart_boundary(self.request.headers.get("Content-Type"))
+            except Exception:
+                raise tornado.web.HTTPError(400, "multipart/form-data is required")
+            self._parser = MultipartStreamParser(boundary.encode())
+
+    # an error raised here would only close the connection, so it is kept until the body is asked for
+    def data_received(self, chunk):
+        if self._error:
+            return
+        try:
+            self._parser.feed(chunk)
+        except ValueError as e:
+            self._error = e
+
+    def getBody(self):
+        if not self._error:
+            try:
+                self._parser.close()
+            except ValueError as e:
+                self._error = e
+        if self._error:
+            raise tornado.web.HTTPError(400, "malformed multipart body: {}".format(self._error))
+        return self._parser.result()
+
+    # a route cancelled on timeout may leave a blocking job still reading fdata
+    def on_finish(self):
+        if self._parser and self._parser.fdata:
+            from xspawner import XSpawner # NOQA
+            XSpawner.getServer().afterSync(self._parser.fdata.close)
+
 
 class UiHandler:
     path_map = {}
@@ -182,8 +531,112 @@ class UiHandler:
         return decorator
 
 
+# FlowChannel fans the events of one broadcast flow out to its subscribers
+#   the route runs once per interval while anyone is subscribed, each event is encoded once
+#   every subscriber buffers up to flow.backlog events, a full one is evicted instead of stalling the others
+#   events are numbered and the last flow.replay ones are kept for subscribers resuming after a gap,
+#   ids start from the boot time in ms so that they keep growing across restarts
+class FlowChannel:
+    def __init__(self, flow, server):
+        self.flow = flow
+        self.server = server
+        self.subscribers = set()
+        self.producer = None
+        self.ids = itertools.count(int(time.time() * 1000))
+        self.history = deque(maxlen=flow.replay)
+        self.stats = {"published": 0, "evicted": 0, "replayed": 0, "snapshots": 0}
+
+    def encode(self, evt):
+        eid = next(self.ids)
+        chunk = encode_event(dict(evt, id=eid))
+        self.history.append((eid, chunk))
+        return chunk
+
+    # last_id is the Last-Event-ID of a resuming subscriber, it gets the newer events still kept
+    #   it resumes only if last_id lies within the kept ids, so an id from a restarted server,
+    #   another worker or one ahead of the history cannot resume
+    #   a subscriber that cannot resume gets flow.snapshot first if there is one, else the whole backlog
+    def subscribe(self, last_id=None):
+        queue = tornado.queues.Queue(self.flow.backlog)
+        resumed = (
+            last_id is not None and bool(self.history)
+            and self.history[0][0] - 1 <= last_id <= self.history[-1][0]
+        )
+        missed = [(eid, chunk) for eid, chunk in self.history if resumed and eid > last_id]
+        if resumed and len(missed) >= self.flow.backlog:
+            resumed = False
+        if self.flow.snapshot and not resumed:
+            evt = self.flow.snapshot(self.server, {}, {})
+            if evt:
+                queue.put_nowait(encode_event(dict(evt, id=self.history[-1][0])) if self.history else encode_event(evt))
+                self.stats["snapshots"] += 1
+        else:
+            if not resumed and last_id is not None:
+                missed = list(self.history)
+            for eid, chunk in missed[-self.flow.backlog:]:
+                queue.put_nowait(chunk)
+            self.stats["replayed"] += len(missed[-self.flow.backlog:])
+        self.subscribers.add(queue)
+        if self.producer is None:
+            self.producer = asyncio.ensure_future(self.produce())
+        return queue
+
+    def unsubscribe(self, queue):
+        self.subscribers.discard(queue)
+        self.stop()
+
+    # drop what is buffered and wake the subscriber with the end mark
+    def close(self, queue):
+        self.subscribers.discard(queue)
+        while queue.qsize():
+            queue.get_nowait()
+        queue.put_nowait(None)
+        self.stop()
+
+    # cancel the producer when the last subscriber is gone, an idle flow would keep waiting for its next event,
+    #   the producer itself stops after publishing to nobody
+    def stop(self):
+        if self.subscribers or self.producer is None or self.producer is asyncio.current_task():
+            return
+        producer, self.producer = self.producer, None
+        producer.cancel()
+
+    def publish(self, chunk):
+        self.stats["published"] += 1
+        for queue in list(self.subscribers):
+            try:
+                queue.put_nowait(chunk)
+            except tornado.queues.QueueFull:
+                self.stats["evicted"] += 1
+                self.server.wLog("flow %s evicts a slow subscriber", self.flow.path)
+                self.close(queue)
+
+    async def produce(self):
+        events = iter_events(self.flow, self.server, {}, {}, self.flow.interval, self.encode)
+        try:
+            async for chunk in events:
+                self.publish(chunk)
+                if not self.subscribers:
+                    break
+            else:
+                self.server.iLog("flow %s is closed from server", self.flow.path)
+        except Exception as e:
+            self.server.eLog("flow %s is closed on exception %s:%s", self.flow.path, e.__class__.__name__, e)
+        finally:
+            await events.aclose()
+            # a cancelled producer may already be replaced by a new one serving the new subscribers
+            if self.producer is asyncio.current_task():
+                self.producer = None
+                for queue in list(self.subscribers):
+                    self.close(queue)
+
+    def getMetrics(self):
+        return dict(self.stats, subscribers=len(self.subscribers))
+
+
 class FlowHandler(tornado.web.RequestHandler):
     SUPPORTED_METHODS = ("GET", "OPTIONS")
+    # path_map is path to flows like dict {<get path> : <Flow>}
     path_map = {}
 
     # CORS
@@ -200,20 +653,24 @@ class FlowHandler(tornado.web.RequestHandler):
         self.set_header('Content-Type', 'text/event-stream')
         self.set_header('Cache-Control', 'no-cache')
         self.set_header('Connection', 'keep-alive')
+        self._subscription = None
+        self._streaming = None
 
     def on_finish(self):
         # Ensure the client disconnects when the handler is finished
         if not self._finished:
             self.finish()
 
+    # wake a broadcast subscriber or stop a client's own flow that is waiting for the next event
+    def on_connection_close(self):
+        super().on_connection_close()
+        if self._subscription:
+            channel, queue = self._subscription
+            channel.close(queue)
+        if self._streaming:
+            self._streaming.cancel()
+
     async def get(self):
-        async def call_cbf(fun, *args, **kwargs):
-            if inspect.iscoroutinefunction(fun):
-                res = await fun(*args, **kwargs)
-            else:
-                res = fun(*args, **kwargs)
-            return res
-        # Send a message to the client every second
         path = self.request.path
         headers = dict(self.request.headers.get_all())
         interval = float(self.get_argument('interval', default="1.0"))
@@ -224,36 +681,125 @@ class FlowHandler(tornado.web.RequestHandler):
         gServer = XSpawner.getServer()
         assert gServer
         if path in self.path_map:
-            f, varnames = self.path_map[path]
+            flow = self.path_map[path]
+            if flow.primary and gServer.getPrimaryAddr():
+                await self.forward(gServer.getPrimaryAddr())
+                return
+            if flow.broadcast:
+                await self.subscribe(gServer.getFlowChannel(path), self.getLastEventId())
+                return
             reqargs = self.request.arguments
             args = {arg: reqargs[arg][0].decode() for arg in reqargs}
+            # Send messages to the client as they are produced
+            events = iter_events(flow, gServer, headers, args, interval)
+            self._streaming = asyncio.current_task()
             try:
-                while True:
-                    evt = await call_cbf(f, gServer, headers, args)
-                    if evt:
-                        for k in evt:
-                            text = "{}: {}\n".format(k, evt[k])
-                            self.write(text)
-                        self.write("\n")
-                        await self.flush()
-                    elif evt is False:
-                        print(f"stream is closed from server {path}")
-                        self.finish()
-                        return
-                    else:
-                        pass
-                    await tornado.gen.sleep(interval)
+                async for chunk in events:
+                    self.write(chunk)
+                    await self.flush()
+                print(f"stream is closed from server {path}")
+            except (tornado.iostream.StreamClosedError, asyncio.CancelledError):
+                return
             except Exception as e:
                 print(traceback.format_exc())
                 print("stream is closed on exception: {}".format(str(e)))
+            finally:
+                self._streaming = None
+                await events.aclose()
             self.finish()
             return
 
+    # relay the event stream of the primary worker until it or the client closes
+    async def forward(self, addr):
+        def on_chunk(chunk):
+            if not self.request.connection.stream.closed():
+                self.write(chunk)
+                self.flush()
+        # the simple client can be closed while a request is still running, unlike the curl one
+        client = tornado.simple_httpclient.SimpleAsyncHTTPClient(force_instance=True)
+        request = tornado.httpclient.HTTPRequest(
+            url=addr + self.request.uri,
+            method="GET",
+            headers={k: v for k, v in self.request.headers.get_all() if k.lower() in FORWARD_HEADERS},
+            streaming_callback=on_chunk,
+            request_timeout=0,
+            connect_timeout=REQ_TIMEOUT
+        )
+        self._streaming = asyncio.current_task()
+        try:
+            await client.fetch(request)
+        except asyncio.CancelledError:
+            return
+        except Exception as e:
+            print("forwarded stream is closed on exception: {}".format(str(e)))
+        finally:
+            self._streaming = None
+            client.close()
+        if not self._finished and not self.request.connection.stream.closed():
+            self.finish()
+
+    def getLastEventId(self):
+        try:
+            return int(self.request.headers.get("Last-Event-ID", ""))
+        except ValueError:
+            return None
+
+    # relay the pre-encoded events of a shared channel until it or the client closes
+    async def subscribe(self, channel, last_id=None):
+        queue = channel.subscribe(last_id)
+        self._subscription = (channel, queue)
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                self.write(chunk)
+                await self.flush()
+        except tornado.iostream.StreamClosedError:
+            pass
+        finally:
+            channel.unsubscribe(queue)
+            self._subscription = None
+        if not self._finished and not self.request.connection.stream.closed():
+            self.finish()
+
+    # broadcast: run the route once per interval for all clients of the path instead of once per client,
+    #   it gets empty headers and args and the client's interval argument is ignored
+    # interval: seconds between two broadcast runs
+    # backlog: max events buffered for a broadcast client before it is evicted as too slow
+    # push: await a coroutine route again as soon as it returns, it waits for its own event source,
+    #   an async generator route is always pushed
+    # coalesce: seconds to gather the events following a pushed one into the same write, 0 writes each at once
+    # replay: number of broadcast events kept for clients reconnecting with Last-Event-ID
+    # snapshot: sync route-like fun whose event is sent first to a broadcast client that cannot resume,
+    #   for flows sending only changes
+    # primary: stream it from the primary pre-forked worker only, like ApiHandler.route(primary=True)
     @classmethod
-    def route(cls, path):
+    def route(cls, path, broadcast=False, interval=1.0, backlog=FLOW_BACKLOG, push=False, coalesce=0.0, replay=FLOW_REPLAY, snapshot=None, primary=False):
         def decorator(f):
-            varnames = f.__code__.co_varnames[1:] if len(f.__code__.co_varnames) > 1 else ()
-            cls.path_map[path] = (f, varnames)
+            if push and not (inspect.iscoroutinefunction(f) or inspect.isasyncgenfunction(f)):
+                raise ValueError('{}: only coroutine can be pushed'.format(f.__code__.co_name))
+            if interval <= 0:
+                raise ValueError('{}: invalid interval {}'.format(f.__code__.co_name, interval))
+            if backlog <= 0:
+                raise ValueError('{}: invalid backlog {}'.format(f.__code__.co_name, backlog))
+            if snapshot and not (broadcast and inspect.isfunction(snapshot) and not inspect.iscoroutinefunction(snapshot)):
+                raise ValueError('{}: snapshot must be a sync function of a broadcast flow'.format(f.__code__.co_name))
+            if replay < 0:
+                raise ValueError('{}: invalid replay {}'.format(f.__code__.co_name, replay))
+            cls.path_map[path] = Flow(
+                path=path,
+                fun=f,
+                varnames=f.__code__.co_varnames[1:] if len(f.__code__.co_varnames) > 1 else (),
+                broadcast=broadcast,
+                interval=interval,
+                backlog=backlog,
+                push=push or inspect.isasyncgenfunction(f),
+                coalesce=coalesce,
+                replay=replay,
+                snapshot=snapshot,
+                primary=primary
+            )
             return f
         return decorator
 
@@ -296,12 +842,7 @@ class State(UserDict):
 
 class SrvJSONEncoder(json.JSONEncoder):
     def default(self, obj):
-        if isinstance(obj, Config):
-            return obj._asdict()
-        if isinstance(obj, State):
-            return obj.__json__()
-        else:
-            return super().default(obj)
+        return codec.default(obj)
 
 class Spawnable(object):
 
@@ -358,44 +899,84 @@ class XSpawner(Spawnable):
     # _instance is xspawner singleton service
     # _children is the subordinate services spawned by service
     # _state is internal state in service
+    # _sockets are the listening sockets shared by pre-forked workers
+    # _task_id is the pre-forked worker number, 0 is the primary
+    # _primary_sockets are the loopback sockets where the primary serves the routes forwarded by the others
     def __init__(self, config, state, children, **kwargs):
         print("__init__ BEG {} {}".format(config, kwargs))
         self._config = config
         self._state = state
         self._children = children
+        self._sockets = kwargs.get("sockets")
+        self._task_id = kwargs.get("task_id", 0)
+        self._primary_sockets = kwargs.get("primary_sockets")
+        self._primary_port = self._primary_sockets[0].getsockname()[1] if self._primary_sockets else None
+        self._primary_server = None
+
+        # pre-forked workers keep state and children in the shared store
+        store = kwargs.get("store")
+        if store:
+            shared_state = store.state()
+            for key, value in state.items():
+                shared_state.setdefault(key, value)
+            self._state.data = shared_state
+            self._children = store.children()
+
+        # core queue of (lane priority, sequence, request), its admission counters and its consumers' guards
+        #   every lane admits up to config.queue requests
+        self._req_queue = tornado.queues.PriorityQueue()
+        self._req_seq = itertools.count()
+        self._lane_depth = {lane: 0 for lane in REQ_LANES}
+        self._req_stats = {"admitted": 0, "rejected": 0, "dropped": 0, "cancelled": 0}
+        self._serial_lock = tornado.locks.Lock()
+        self._route_sems = {
+            path: tornado.locks.Semaphore(route.limit)
+            for path, route in ApiHandler.path_map.items() if route.limit > 0
+        }
 
-        # core queue
-        self._req_queue = tornado.queues.Queue(256)
+        # bounded pool for blocking work, pending counts both running and waiting jobs
+        self._executor = concurrent.futures.ThreadPoolExecutor(
+            max_workers=config.threads,
+            thread_name_prefix=config.name
+        )
+        self._pool_stats = {"submitted": 0, "completed": 0, "pending": 0, "peak": 0}
+        self._sync_jobs = set()
+
+        # shared channels of broadcast flows, opened by their first subscriber
+        self._flows = {}
         self._ioloop = tornado.ioloop.IOLoop.current()
         self._ioloop.add_callback(self.loop)
 
-        # use CurlHTTPClient for more stable Connection
+        # use CurlHTTPClient for more stable Connection, its connections are kept alive for reuse
         tornado.httpclient.AsyncHTTPClient.configure(
-            "tornado.curl_httpclient.CurlAsyncHTTPClient"
+            "tornado.curl_httpclient.CurlAsyncHTTPClient",
+            max_clients=POOL_MAX_CLIENTS
         )
 
-        # start logger
+        # start logger, records are written by its background thread unless logqueue is 0
+        #   they are shipped in batches to the recorder url if any, otherwise to the log file
         self._logger = Log(
             config.name,
-            "file",
-            self.getLogFile(),
-            config.severity
+            "http" if config.recorder else "file",
+            config.recorder or self.getLogFile(),
+            config.severity,
+            config.logqueue
         )
 
-        # inform ancestry to add child
-        if config.ancestry:
+        # inform ancestry to add child, once for all workers
+        if config.ancestry and self._task_id == 0:
             try:
                 ancestry_service, ancestry_port = parse_ancestry(config.ancestry)
                 ancestry_addr = "{}:{}".format(self.getHostAddr(), ancestry_port)
-                response_json = requests.post(ancestry_addr + "/add_child", json={"name": config.name, "addr": self.getAddr()})
-                self.iLog(f"add child response {response_json}")
+                response_json = postSyncReq(ancestry_addr + "/add_child", {"name": config.name, "addr": self.getAddr()})
+                self.iLog("add child response %s", response_json)
             except Exception as e:
-                self.eLog('Exception on adding child request {}:{}'.format(e.__class__.__name__, e))
+                self.eLog("Exception on adding child request %s:%s", e.__class__.__name__, e)
 
         handlers = []
         # user handlers are prior
         for path in ApiHandler.path_map:
-            handlers.append((path, ApiHandler))
+            handlers.append((path, UploadHandler if ApiHandler.path_map[path].stream else ApiHandler))
         for path in FlowHandler.path_map:
             handlers.append((path, FlowHandler))
         for path in UiHandler.path_map:
@@ -420,102 +1001,159 @@ class XSpawner(Spawnable):
         else:
             self._server = tornado.httpserver.HTTPServer(app)
             self.iLog("httpserver is without specific ssl certification")
+        # forwarded requests come over loopback, so the primary serves them without ssl
+        if self._primary_sockets and self._task_id == 0:
+            self._primary_server = tornado.httpserver.HTTPServer(app)
         print("__init__ END")
 
 
-    def dLog(self, *content):
-        self._logger.debug("; ".join(str(x) for x in content))
+    # logs take %-style arguments like logging, they are formatted only when the level is enabled
+    #   and then by the logger's background thread, or at once if an argument is a container
+    def dLog(self, msg, *args):
+        self._logger.debug(msg, *args)
 
-    def iLog(self, *content):
-        self._logger.info("; ".join(str(x) for x in content))
+    def iLog(self, msg, *args):
+        self._logger.info(msg, *args)
 
-    def wLog(self, *content):
-        self._logger.warning("; ".join(str(x) for x in content))
+    def wLog(self, msg, *args):
+        self._logger.warning(msg, *args)
 
-    def eLog(self, *content):
-        self._logger.error("; ".join(str(x) for x in content))
+    def eLog(self, msg, *args):
+        self._logger.error(msg, *args)
 
-    def cLog(self, *content):
-        self._logger.critical("; ".join(str(x) for x in content))
+    def cLog(self, msg, *args):
+        self._logger.critical(msg, *args)
 
 
-    # consumer for queue
-    async def loop(self):
-        self.iLog("loop BEG")
-        def parse_multipart_boundary(ct):
-            assert isinstance(ct, str)
-            [ct1, ct2] = ct.split("; ")
-            [ct2a, ct2b] = ct2.split("=")
-            return ct2b
-
-        async def call_cbf(fun, *args, **kwargs):
-            if inspect.iscoroutinefunction(fun):
-                res = await fun(*args, **kwargs)
-            else:
-                res = fun(*args, **kwargs)
-            return res
-
-        def make_cbf_params(fun, ct, body):
-            # fun.__code__.co_argcount = 1(self) + N({}|args|fdata, fname, farg)
-            if fun.__code__.co_argcount == 1: # for UiHandler
-                self.iLog("{} without params".format(fun.__code__.co_name))
-                return ()
-            elif fun.__code__.co_argcount == 3: # for ApiHandler I (normal) or FlowHandler
-                # transport JSON
-                jdata = body.decode()
-                self.iLog("{} with params {}".format(fun.__code__.co_name, jdata))
-                return (json.loads(jdata),)
-            elif fun.__code__.co_argcount == 5: # for ApiHandler II (upload)
-                # transport File
-                boundary = parse_multipart_boundary(ct)
-                args, docs = dict(), dict()
-                tornado.httputil.parse_multipart_form_data(boundary.encode(), body, args, docs)
-                # if filename is not empty string
-                #   args is dict like {"v1": [b"xyz"]}
-                #   docs is dict like {"file": [{"filename": "xFEs3r8w.html", "body": b"....", "content_type": "text/html"}]
-                # else
-                #   args is dict like {"file": [b"...."], "v1": [b"xyz"]}
-                #   docs is empty dict {}
-                if docs:
-                    lv = list(docs.values())
-                    fdata = lv[0][0]["body"]
-                    fname = lv[0][0]["filename"]
-                else:
-                    fdata = args.pop("file")[0]
-                    fname = ""
-                fargs = {k: args[k][0].decode() for k in args}
-                self.iLog("{} with params [{}] {} {}".format(fun.__code__.co_name, len(fdata), fname, fargs))
-                return (fdata, fname, fargs)
-            else:
-                self.eLog('{}: invalid argument count {}'.format(fun.__code__.co_name, fun.__code__.co_argcount))
-
+    # run the route with the request headers and body
+    #   the result is returned or an exception is raised
+    async def dispatch(self, route, headers, body):
+        self.dLog("dispatch %s %s [%s]", route.path, route.name, len(body))
+        params = route.decode(headers, body)
+        args = (self, headers) + params if route.arity > 1 else (self,)
 
-        async for (future, condition, path, headers, body) in self._req_queue:
+        # serial routes exclude each other, limited routes are bounded by their semaphores
+        if route.serial:
+            guard = self._serial_lock
+        elif route.path in self._route_sems:
+            guard = self._route_sems[route.path]
+        else:
+            guard = None
+        if guard:
+            async with guard:
+                res = await self.invoke(route, args)
+        else:
+            res = await self.invoke(route, args)
+
+        if not isinstance(res, (str, bool, dict , int, float, list, tuple)):
+            # invalid res type
+            raise Exception("invalid response type {} {}".format(route.name, res))
+        return res
+
+    # admit the request elem of route into the queue
+    #   return False if the route's lane is full
+    def enqueue(self, route, elem):
+        if self._lane_depth[route.lane] >= self.getConfig().queue:
+            self._req_stats["rejected"] += 1
+            self.wLog("%s is rejected on full lane %s", route.path, route.lane)
+            return False
+        self._lane_depth[route.lane] += 1
+        self._req_stats["admitted"] += 1
+        self._req_queue.put_nowait((REQ_LANES.index(route.lane), next(self._req_seq), elem))
+        return True
+
+    async def invoke(self, route, args):
+        if route.coro:
+            return await route.fun(*args)
+        elif route.offload:
+            return await self.runSync(route.fun, *args)
+        else:
+            return route.fun(*args)
+
+    # run blocking fun(writer, *args) in the thread pool and yield what it writes to writer chunk by chunk
+    #   writer is file-like and unseekable, a slow reader holds the writing thread back
+    async def streamSync(self, fun, *args):
+        queue = asyncio.Queue(4)
+        writer = ChunkWriter(asyncio.get_running_loop(), queue)
+        def produce():
+            with writer:
+                fun(writer, *args)
+        task = asyncio.ensure_future(self.runSync(produce))
+        try:
+            while True:
+                chunk = await queue.get()
+                if chunk is None:
+                    break
+                yield chunk
+            await task
+        finally:
+            if not task.done():
+                # the reader is gone, let the writing thread fail and finish
+                writer.aborted = True
+                while not task.done():
+                    try:
+                        await asyncio.wait_for(queue.get(), 1)
+                    except asyncio.TimeoutError:
+                        pass
+                if not task.cancelled():
+                    task.exception()
+
+    # run blocking fun in the thread pool without blocking the ioloop
+    #   a job keeps its thread when the awaiting coroutine is cancelled, so it is counted until it ends
+    async def runSync(self, fun, *args):
+        stats = self._pool_stats
+        stats["submitted"] += 1
+        stats["pending"] += 1
+        stats["peak"] = max(stats["peak"], stats["pending"])
+        job = self._executor.submit(fun, *args)
+        self._sync_jobs.add(job)
+        job.add_done_callback(lambda job: self._ioloop.add_callback(self.finishSync, job))
+        return await asyncio.wrap_future(job)
+
+    # call cb once the blocking jobs running now have finished, like closing the files they may read
+    def afterSync(self, cb):
+        jobs = [asyncio.wrap_future(job) for job in self._sync_jobs if not job.done()]
+        if jobs:
+            asyncio.gather(*jobs, return_exceptions=True).add_done_callback(lambda _: cb())
+        else:
+            cb()
+
+    def finishSync(self, job):
+        self._sync_jobs.discard(job)
+        self._pool_stats["pending"] -= 1
+        self._pool_stats["completed"] += 1
+
+    # one of consumers for queue
+    async def work(self, wid):
+        self.dLog("work %s BEG", wid)
+        async for (_, _, (future, route, headers, body, deadline)) in self._req_queue:
+            self._lane_depth[route.lane] -= 1
             try:
-                fun = ApiHandler.path_map[path]
-                ct = headers["Content-Type"] if "Content-Type" in headers else None
-                self.dLog("make_cbf_params {} {} {}".format(fun, ct, body))
-                params = make_cbf_params(fun, ct, body)
-                if isinstance(params, tuple):
-                    res = await call_cbf(fun, self, headers, *params) if params else await call_cbf(fun, self)
-                    if any([isinstance(res, t) for t in (str, bool, dict , int, float, list, tuple)]):
-                        if not future.done():
-                            future.set_result(res)
-                            condition.notify()
-                    else:
-                        # invalid res type
-                        raise Exception("invalid response type {} {}".format(fun.__code__.co_name, res))
-                else:
-                    # invalid args
-                    raise Exception("invalid arguments type {} {}".format(fun.__code__.co_name, params))
+                remain = deadline - self._ioloop.time()
+                if future.done() or remain <= 0:
+                    # the request has been given up
+                    self._req_stats["dropped"] += 1
+                    self.wLog("%s is dropped on timeout %s", route.path, route.timeout)
+                    continue
+                res = await asyncio.wait_for(self.dispatch(route, headers, body), remain)
+                if not future.done():
+                    future.set_result(res)
+            except asyncio.TimeoutError:
+                self._req_stats["cancelled"] += 1
+                self.wLog("%s is cancelled on timeout %s", route.path, route.timeout)
             except Exception as e:
                 self.eLog(traceback.format_exc())
                 if not future.done():
                     self.eLog(repr(e))
                     future.set_result(False)
-                    condition.notify()
             finally:
                 self._req_queue.task_done()
+        self.dLog("work %s END", wid)
+
+    # pool of consumers for queue
+    async def loop(self):
+        self.iLog("loop BEG %s", self.getConfig().concurrency)
+        await asyncio.gather(*[self.work(wid) for wid in range(max(1, self.getConfig().concurrency))])
         self.cLog("loop is going to stop...")
         self.stop()
         self.iLog("loop END")
@@ -523,8 +1161,18 @@ class XSpawner(Spawnable):
 
     def start(self):
         self.iLog("start BEG")
-        self._server.listen(self.getConfig().port, address=self.getConfig().access)
-        self.iLog("listening to port {}...".format(self.getConfig().port))
+        if self._sockets:
+            self._server.add_sockets(self._sockets)
+            self.iLog("worker %s is sharing port %s...", self._task_id, self.getConfig().port)
+            if self._primary_server:
+                self._primary_server.add_sockets(self._primary_sockets)
+                self.iLog("primary worker is serving forwarded routes at port %s", self._primary_port)
+            elif self._primary_sockets:
+                for sock in self._primary_sockets:
+                    sock.close()
+        else:
+            self._server.listen(self.getConfig().port, address=self.getConfig().access)
+            self.iLog("listening to port %s...", self.getConfig().port)
         self._ioloop.start()
         self.iLog("ioloop is started")
         self._ioloop.close()
@@ -532,8 +1180,11 @@ class XSpawner(Spawnable):
 
     def stop(self):
         self.iLog("stop BEG")
-        self.cLog("This instance {}:{} is stopping ...".format(self.__class__, self.getConfig().port))
+        self.cLog("This instance %s:%s is stopping ...", self.__class__, self.getConfig().port)
         self._server.stop()
+        if self._primary_server:
+            self._primary_server.stop()
+        self._executor.shutdown(wait=False)
         self._ioloop.stop()
         self.iLog("stop END")
 
@@ -545,6 +1196,12 @@ class XSpawner(Spawnable):
     def getPid(self):
         return os.getpid()
 
+    # address where a non-primary pre-forked worker forwards the primary routes, None if it serves them
+    def getPrimaryAddr(self):
+        if self._primary_port and self._task_id != 0:
+            return "http://127.0.0.1:{}".format(self._primary_port)
+        return None
+
     def getConfig(self):
         return self._config
 
@@ -555,7 +1212,7 @@ class XSpawner(Spawnable):
         return self._state.update(data)
 
     def getChildren(self):
-        return self._children
+        return list(self._children)
 
     def getChild(self, name):
         return search_list_of_dict(
@@ -567,11 +1224,11 @@ class XSpawner(Spawnable):
     def delChild(self, name):
         child = self.getChild(name)
         if child:
-            self.getChildren().remove(child)
+            self._children.remove(child)
 
     def addChild(self, child):
         if child:
-            self.getChildren().append(child)
+            self._children.append(child)
 
 
     # implement singleton
@@ -591,7 +1248,7 @@ class XSpawner(Spawnable):
         return issubclass(kls, cls) and kls is not cls
 
     async def testServer(self, port, host="localhost", ssl=False):
-        self.iLog("testServer BEG {} {} {}".format(port, host, ssl))
+        self.iLog("testServer BEG %s %s %s", port, host, ssl)
         tcp_client = tornado.tcpclient.TCPClient()
         try:
             stream = await tcp_client.connect(host, port, ssl_options=ssl.create_default_context() if ssl else None)
@@ -599,19 +1256,48 @@ class XSpawner(Spawnable):
             self.iLog("testServer END true")
             return True
         except Exception as e:
-            self.eLog(f'WARN: url {url} is not connected: {e}')
+            self.eLog("WARN: url %s is not connected: %s", url, e)
             self.wLog("testServer END false")
             return False    # failed and stop connect try
 
+    # poll addr/ping with exponential backoff until the server answers (up) or refuses (not up)
+    #   False if it is still not so after timeout seconds
+    async def waitServer(self, addr, up=True, timeout=PROBE_TIMEOUT):
+        self.dLog("waitServer BEG %s %s", addr, up)
+        deadline = self._ioloop.time() + timeout
+        delay = PROBE_DELAY
+        while True:
+            try:
+                await fetch_async(f"{addr}/ping", request_timeout=PROBE_DELAY_MAX, validate_cert=False)
+                alive = True
+            except tornado.httpclient.HTTPClientError as e:
+                # 599 is no response at all
+                alive = e.code != 599
+            except Exception:
+                alive = False
+            if alive == up:
+                self.dLog("waitServer END true")
+                return True
+            remain = deadline - self._ioloop.time()
+            if remain <= 0:
+                self.wLog("waitServer END false, %s is still %s", addr, "down" if up else "up")
+                return False
+            await tornado.gen.sleep(min(delay, remain))
+            delay = min(delay * 2, PROBE_DELAY_MAX)
+
     # jdata is dict or bool/int/list or None
+    # call a route from the server's own code, a non-primary worker posts a primary route to the primary worker
+    async def callRoute(self, path, data):
+        route = ApiHandler.path_map[path]
+        if route.primary and self.getPrimaryAddr():
+            return await self.postJson(self.getPrimaryAddr() + path, data)
+        return await call_cbf(route.fun, self, None, data)
+
     async def postJson(self, url, jdata):
-        self.iLog("postJson BEG {} {}".format(url, jdata))
-        headers = {
-            "Content-Type": "application/json"
-        }
-        body = json.dumps(jdata) 
+        self.iLog("postJson BEG %s %s", url, jdata)
+        headers, body = make_json_request(url, jdata)
         rt = await postAsync(url, headers, body)
-        self.iLog("postJson END {}".format(rt))
+        self.iLog("postJson END %s", rt)
         return rt
 
     # fdata is bytes
@@ -643,7 +1329,7 @@ class XSpawner(Spawnable):
             formatted_time = datetime.datetime.fromtimestamp(start_timestamp).strftime("%Y-%m-%d %H:%M:%S")
             return formatted_time
         except Exception as e:
-            self.eLog("exception getPidTime: {}".format(str(e)))
+            self.eLog("exception getPidTime: %s", str(e))
             return "unknown"
 
 
@@ -670,6 +1356,30 @@ class XSpawner(Spawnable):
         info["logfile"] = self.getLogFile()
         return info
 
+    def getMetrics(self):
+        return {
+            "queue": {
+                "depth": self._req_queue.qsize(),
+                "capacity": self.getConfig().queue,
+                "lanes": dict(self._lane_depth)
+            },
+            "requests": dict(self._req_stats),
+            "workers": self.getConfig().concurrency,
+            "executor": dict(
+                self._pool_stats,
+                threads=self.getConfig().threads,
+                saturated=self._pool_stats["pending"] >= self.getConfig().threads
+            ),
+            "flows": {path: channel.getMetrics() for path, channel in self._flows.items()},
+            "http": get_pool_stats(),
+            "log": self._logger.getStats()
+        }
+
+    def getFlowChannel(self, path):
+        if path not in self._flows:
+            self._flows[path] = FlowChannel(FlowHandler.path_map[path], self)
+        return self._flows[path]
+
     def getHostAddr(self):
         return "{}://{}".format(
             "https" if self.getConfig().ssl else "http",
@@ -677,6 +1387,50 @@ class XSpawner(Spawnable):
         )
 
 
+# StateManager serves the state and children shared by pre-forked workers
+_shared_state = {}
+_shared_children = []
+
+def get_shared_state():
+    return _shared_state
+
+def get_shared_children():
+    return _shared_children
+
+# proxies iterate over one snapshot instead of one remote call per item
+class SharedDictProxy(DictProxy):
+    def __iter__(self):
+        return iter(self.copy())
+
+class SharedListProxy(ListProxy):
+    def __iter__(self):
+        return iter(self[:])
+
+class StateManager(BaseManager):
+    pass
+
+StateManager.register("state", callable=get_shared_state, proxytype=SharedDictProxy)
+StateManager.register("children", callable=get_shared_children, proxytype=SharedListProxy)
+
+
+# bind the listening sockets once and fork config.workers processes sharing them
+#   it must be called before any IOLoop is created
+#   return the extra kwargs of getServer, empty for a single process
+def prefork(config):
+    if config.workers <= 1:
+        return {}
+    sockets = tornado.netutil.bind_sockets(config.port, address=config.access)
+    # routes with primary=True are forwarded to worker 0 at this loopback port
+    primary_sockets = tornado.netutil.bind_sockets(0, address="127.0.0.1")
+    manager = StateManager()
+    manager.start()
+    task_id = tornado.process.fork_processes(config.workers)
+    # every worker has its own connection to the store
+    store = StateManager(address=manager.address)
+    store.connect()
+    return {"sockets": sockets, "primary_sockets": primary_sockets, "store": store, "task_id": task_id}
+
+
 def search_for_class_in_file(fpath, class_name):
     print("search_for_class_in_file BEG {}".format(fpath))
     if get_file_type(fpath) == "text/x-python":